@@ -0,0 +1,131 @@
+"""
+SMTP sender benchmark: messages per second of the pooled EmailSender against
+a new connection per message (what the fastapi-mail based send_email did).
+
+    python -m benchmarks.email_sender --messages 500 --pool-size 1 4
+
+A local aiosmtpd server that discards messages is started, so the numbers show
+the connection and protocol overhead only. Pass --latency to add a delay to every
+server reply and approximate a remote relay.
+"""
+import argparse
+import asyncio
+import json
+import time
+from email.message import EmailMessage
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+
+from src.services.email import EmailSender
+
+
+class Sink:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.latency)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return "250 OK"
+
+
+def make_message(number: int) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = "Confirm your email "
+    message["From"] = "bench@example.com"
+    message["To"] = f"user{number}@example.com"
+    message.set_content(f"<p>Hi user{number}</p>", subtype="html")
+    return message
+
+
+async def per_message(port: int, messages: int, concurrency: int) -> float:
+    """
+    The per_message function sends every message over its own connection, concurrency at a time.
+
+    :param port: int: The port of the local server
+    :param messages: int: How many messages to send
+    :param concurrency: int: How many sends run at once
+    :return: The elapsed seconds
+    :doc-author: Trelent
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(number):
+        async with slots:
+            await aiosmtplib.send(make_message(number), hostname="127.0.0.1", port=port, use_tls=False, start_tls=False)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(number) for number in range(messages)))
+    return time.perf_counter() - started
+
+
+async def pooled(port: int, messages: int, pool_size: int) -> float:
+    """
+    The pooled function sends every message through one EmailSender.
+
+    :param port: int: The port of the local server
+    :param messages: int: How many messages to send
+    :param pool_size: int: The number of pooled connections
+    :return: The elapsed seconds
+    :doc-author: Trelent
+    """
+    sender = EmailSender("127.0.0.1", port, use_tls=False, start_tls=False, pool_size=pool_size)
+    started = time.perf_counter()
+    await asyncio.gather(*(sender.send(make_message(number)) for number in range(messages)))
+    elapsed = time.perf_counter() - started
+    await sender.close()
+    return elapsed
+
+
+async def run(args) -> list:
+    results = []
+    handler = Sink(args.latency)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        for pool_size in args.pool_size:
+            for mode in ("per-message", "pooled"):
+                if mode == "pooled":
+                    elapsed = await pooled(args.port, args.messages, pool_size)
+                else:
+                    elapsed = await per_message(args.port, args.messages, pool_size)
+                results.append({
+                    "mode": mode,
+                    "connections": pool_size,
+                    "messages": args.messages,
+                    "seconds": round(elapsed, 3),
+                    "messages_per_second": round(args.messages / elapsed, 1),
+                })
+    finally:
+        controller.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to EHLO and DATA replies")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{'mode':>12} {'conns':>5} {'messages':>8} {'seconds':>8} {'msg/s':>8}")
+    for result in results:
+        print(f"{result['mode']:>12} {result['connections']:>5} {result['messages']:>8} "
+              f"{result['seconds']:>8} {result['messages_per_second']:>8}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+HTTP load test: throughput and p50/p95/p99 latency for every route of the API.
+
+    docker-compose up -d                          # Postgres and Redis
+    alembic upgrade head && uvicorn main:app      # the app under test, with the same .env
+    python -m benchmarks.load_test --users 5 --concurrency 20 --seconds 30 --json after.json
+    python -m benchmarks.load_test ... --json after.json --baseline before.json
+
+Each virtual user goes through signup -> confirm -> login -> refresh (the confirmation
+token is signed locally with SECRET_KEY, so the .env must match the server's) and creates
+--contacts contacts. Then --concurrency workers call the contact routes in rotation for
+--seconds. --asgi drives main:app in this process instead of over the network.
+Start the server with RATE_LIMIT_ENABLED=false unless the limiter itself is under test.
+
+Results are JSON keyed by route template; with --baseline every route is compared with an
+earlier run and the exit status is 1 when a p95 got worse than --threshold.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        """
+        The request function sends one request and records its latency and status under the route template.
+
+        :param self: Represent the instance of the class
+        :param client: httpx.AsyncClient: The client
+        :param route: str: The route template the request is recorded under
+        :param method: str: The HTTP method
+        :param url: str: The actual url
+        :return: The response, or None if the request failed
+        :doc-author: Trelent
+        """
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as err:
+            self.statuses[route][type(err).__name__] += 1
+            return None
+        finally:
+            self.latencies[route].append(time.perf_counter() - started)
+        self.statuses[route][str(response.status_code)] += 1
+        return response
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest rank: the smallest value with at least p% of the values at or below it
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered) / 100) - 1)]
+
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    """
+    The summarize function turns the recorded latencies into per-route statistics in milliseconds.
+
+    :param recorder: Recorder: The recorded requests
+    :param seconds: float: The duration of the phase, used for throughput
+    :return: A dict keyed by route template
+    :doc-author: Trelent
+    """
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        statuses = recorder.statuses[route]
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": sum(count for status, count in statuses.items() if not status.startswith(("2", "3"))),
+            "statuses": dict(statuses),
+            "rps": round(len(latencies) / seconds, 1),
+            "p50_ms": round(1000 * percentile(latencies, 50), 2),
+            "p95_ms": round(1000 * percentile(latencies, 95), 2),
+            "p99_ms": round(1000 * percentile(latencies, 99), 2),
+            "max_ms": round(1000 * max(latencies), 2),
+        }
+    return routes
+
+
+def contact_body(run: str, user: int, number: int) -> dict:
+    birthday = datetime.date(1990, 1, 1) + datetime.timedelta(days=random.randrange(365 * 20))
+    return {
+        "name": f"Name{number % 50}",
+        "surname": f"Surname{number % 70}",
+        "email": f"c{number}.{user}.{run}@example.com",
+        "phone": f"+380{random.randrange(10 ** 8, 10 ** 9)}",
+        "birthday": birthday.isoformat(),
+        "additional": f"load test contact {number}",
+    }
+
+
+async def setup_user(client: httpx.AsyncClient, recorder: Recorder, run: str, user: int, contacts: int) -> dict:
+    """
+    The setup_user function signs a virtual user up, confirms the email, logs in, refreshes the tokens
+    and creates the contacts the load phase works on.
+
+    :param client: httpx.AsyncClient: The client
+    :param recorder: Recorder: Record the setup requests
+    :param run: str: Makes the emails of this run unique
+    :param user: int: The number of the virtual user
+    :param contacts: int: How many contacts to create
+    :return: A dict with the auth headers and the created contacts
+    :doc-author: Trelent
+    """
+    from src.services.auth import auth_service
+
+    email = f"u{user}.{run}@example.com"
+    password = "secret12"
+    await recorder.request(client, "POST /api/auth/signup", "POST", "/api/auth/signup",
+                           json={"username": f"bench{user}{run}"[:16], "email": email, "password": password})
+    token = auth_service.create_email_token({"sub": email})
+    await recorder.request(client, "GET /api/auth/confirmed_email/{token}", "GET", f"/api/auth/confirmed_email/{token}")
+    response = await recorder.request(client, "POST /api/auth/login", "POST", "/api/auth/login",
+                                      data={"username": email, "password": password})
+    if response is None or response.status_code != 200:
+        raise SystemExit(f"login failed: {response.text if response is not None else 'no response'}")
+    refresh = response.json()["refresh_token"]
+    response = await recorder.request(client, "GET /api/auth/refresh_token", "GET", "/api/auth/refresh_token",
+                                      headers={"Authorization": f"Bearer {refresh}"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    created = []
+    for number in range(contacts):
+        response = await recorder.request(client, "POST /api/contacts/", "POST", "/api/contacts/",
+                                          json=contact_body(run, user, number), headers=headers)
+        if response is not None and response.status_code == 201:
+            created.append(response.json())
+    return {"user": user, "headers": headers, "contacts": created, "next": contacts}
+
+
+def operations(run: str):
+    """
+    The operations function lists the requests of the load phase, one per route.
+    Each takes the client, the recorder and a virtual user and sends one request.
+
+    :param run: str: Makes the emails of this run unique
+    :return: A list of coroutine functions
+    :doc-author: Trelent
+    """
+    def pick(state):
+        return random.choice(state["contacts"])
+
+    async def list_contacts(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/", "GET", "/api/contacts/?limit=20", headers=state["headers"])
+
+    async def list_sorted(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/?sort=name", "GET", "/api/contacts/?limit=20&sort=name",
+                               headers=state["headers"])
+
+    async def by_id(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/id/{id}", "GET", f"/api/contacts/id/{pick(state)['id']}",
+                               headers=state["headers"])
+
+    async def by_name(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/name/{name}", "GET", f"/api/contacts/name/{pick(state)['name']}",
+                               headers=state["headers"])
+
+    async def by_surname(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/surname/{surname}", "GET",
+                               f"/api/contacts/surname/{pick(state)['surname']}", headers=state["headers"])
+
+    async def by_email(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/email/{email}", "GET", f"/api/contacts/email/{pick(state)['email']}",
+                               headers=state["headers"])
+
+    async def search(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/search", "GET", "/api/contacts/search",
+                               params={"q": pick(state)["surname"][:6]}, headers=state["headers"])
+
+    async def birthdays(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/birthdays_in_next_week", "GET",
+                               "/api/contacts/birthdays_in_next_week?days=30", headers=state["headers"])
+
+    async def export(client, recorder, state):
+        await recorder.request(client, "GET /api/contacts/export", "GET", "/api/contacts/export", headers=state["headers"])
+
+    async def me(client, recorder, state):
+        await recorder.request(client, "GET /api/users/me/", "GET", "/api/users/me/", headers=state["headers"])
+
+    async def create_update_delete(client, recorder, state):
+        state["next"] += 1
+        body = contact_body(run, state["user"], state["next"])
+        response = await recorder.request(client, "POST /api/contacts/", "POST", "/api/contacts/", json=body,
+                                          headers=state["headers"])
+        if response is None or response.status_code != 201:
+            return
+        contact_id = response.json()["id"]
+        body["additional"] = "updated"
+        await recorder.request(client, "PUT /api/contacts/{id}", "PUT", f"/api/contacts/{contact_id}", json=body,
+                               headers=state["headers"])
+        await recorder.request(client, "DELETE /api/contacts/{id}", "DELETE", f"/api/contacts/{contact_id}",
+                               headers=state["headers"])
+
+    async def import_contacts(client, recorder, state):
+        lines = []
+        for _ in range(20):
+            state["next"] += 1
+            lines.append(json.dumps(contact_body(run, state["user"], state["next"])))
+        await recorder.request(client, "POST /api/contacts/import", "POST", "/api/contacts/import",
+                               content="\n".join(lines).encode(),
+                               headers={**state["headers"], "Content-Type": "application/x-ndjson"})
+
+    return [list_contacts, list_sorted, by_id, by_name, by_surname, by_email, search, birthdays, export, me,
+            create_update_delete, import_contacts]
+
+
+async def load(client: httpx.AsyncClient, recorder: Recorder, states: list, ops: list, concurrency: int, seconds: float):
+    """
+    The load function runs concurrency workers that call the operations in rotation until the time is up.
+
+    :param client: httpx.AsyncClient: The client
+    :param recorder: Recorder: Record the requests
+    :param states: list: The virtual users
+    :param ops: list: The operations
+    :param concurrency: int: The number of requests in flight
+    :param seconds: float: How long to run
+    :return: None
+    :doc-author: Trelent
+    """
+    deadline = time.perf_counter() + seconds
+
+    async def worker(number):
+        state = states[number % len(states)]
+        for op in itertools.islice(itertools.cycle(ops), number % len(ops), None):
+            if time.perf_counter() >= deadline:
+                return
+            await op(client, recorder, state)
+
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    The compare function prints the p95 change of every route against a baseline run.
+
+    :param results: dict: This run
+    :param baseline: dict: The earlier run
+    :param threshold: float: The relative p95 increase that counts as a regression
+    :return: True if any route regressed
+    :doc-author: Trelent
+    """
+    regressed = False
+    print(f"\n{'route':<48} {'p95 before':>10} {'p95 now':>10} {'change':>8}")
+    for route, now in results["load"].items():
+        before = baseline.get("load", {}).get(route)
+        if not before or not before["p95_ms"]:
+            continue
+        change = now["p95_ms"] / before["p95_ms"] - 1
+        flag = " <-- regression" if change > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{route:<48} {before['p95_ms']:>10} {now['p95_ms']:>10} {change:>+8.0%}{flag}")
+    return regressed
+
+
+def print_table(title: str, routes: dict):
+    print(f"\n{title}\n{'route':<48} {'requests':>8} {'errors':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, stats in routes.items():
+        print(f"{route:<48} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>8} "
+              f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+
+
+async def run(args) -> dict:
+    if args.asgi:
+        from main import app
+
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False), base_url="http://loadtest", timeout=args.timeout)
+    else:
+        app = None
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    run_id = uuid.uuid4().hex[:6]
+    random.seed(args.seed)
+    try:
+        setup = Recorder()
+        started = time.perf_counter()
+        states = await asyncio.gather(*(setup_user(client, setup, run_id, user, args.contacts) for user in range(args.users)))
+        setup_seconds = time.perf_counter() - started
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        await load(client, recorder, list(states), operations(run_id), args.concurrency, args.seconds)
+        load_seconds = time.perf_counter() - started
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    load_results = summarize(recorder, load_seconds)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "target": "asgi" if args.asgi else args.url,
+            "users": args.users,
+            "contacts": args.contacts,
+            "concurrency": args.concurrency,
+            "seconds": args.seconds,
+            "seed": args.seed,
+        },
+        "setup": summarize(setup, setup_seconds),
+        "load": load_results,
+        "total": {
+            "requests": sum(stats["requests"] for stats in load_results.values()),
+            "errors": sum(stats["errors"] for stats in load_results.values()),
+            "rps": round(sum(stats["requests"] for stats in load_results.values()) / load_seconds, 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--asgi", action="store_true", help="run main:app in process")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--contacts", type=int, default=50, help="contacts created per user before the load phase")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95 increase, default 20%%")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table("setup", results["setup"])
+    print_table("load", results["load"])
+    print(f"\ntotal: {results['total']['requests']} requests, {results['total']['errors']} errors, {results['total']['rps']} req/s")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
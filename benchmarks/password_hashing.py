@@ -0,0 +1,76 @@
+"""
+bcrypt micro-benchmark: hashes per second for each work factor and thread count.
+
+    python -m benchmarks.password_hashing --rounds 10 11 12 --threads 1 2 4 --seconds 3
+
+Use it to pick BCRYPT_ROUNDS and PASSWORD_HASH_WORKERS: a login costs one hash,
+so hashes/sec per worker process is the login throughput ceiling of that process.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+
+def measure(rounds: int, threads: int, seconds: float) -> dict:
+    """
+    The measure function hashes a password in a loop on every thread for the given time.
+
+    :param rounds: int: The bcrypt work factor
+    :param threads: int: The number of hashing threads
+    :param seconds: float: How long to run
+    :return: A dict with the number of hashes and the rates
+    :doc-author: Trelent
+    """
+    pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    pwd_context.hash("warm up")
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        done = 0
+        while time.perf_counter() < deadline:
+            pwd_context.hash("benchmark password")
+            done += 1
+        return done
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        hashes = sum(executor.map(lambda _: worker(), range(threads)))
+    elapsed = time.perf_counter() - started
+    per_second = hashes / elapsed
+    return {
+        "rounds": rounds,
+        "threads": threads,
+        "hashes": hashes,
+        "hashes_per_second": round(per_second, 2),
+        "hashes_per_second_per_core": round(per_second / min(threads, os.cpu_count() or 1), 2),
+        "ms_per_hash": round(1000 * elapsed * threads / hashes, 1) if hashes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rounds':>6} {'threads':>7} {'hashes/s':>10} {'per core':>10} {'ms/hash':>8}")
+    for rounds in args.rounds:
+        for threads in args.threads:
+            result = measure(rounds, threads, args.seconds)
+            results.append(result)
+            print(f"{rounds:>6} {threads:>7} {result['hashes_per_second']:>10} "
+                  f"{result['hashes_per_second_per_core']:>10} {result['ms_per_hash']:>8}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"cpu_count": os.cpu_count(), "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
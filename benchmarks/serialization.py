@@ -0,0 +1,139 @@
+"""
+Contact list serialization benchmark: the cost of a GET /api/contacts page per 1000 rows,
+through ORM instances and the response_model versus plain rows and orjson.
+
+    python -m benchmarks.serialization --rows 1000 --repeat 50
+    python -m benchmarks.serialization --url postgresql+psycopg2://... --user-id 1
+
+Without --url the rows live in an in-memory SQLite table, so the numbers show the Python side only:
+building the rows or ORM instances from the driver's tuples, validating and encoding them.
+"orm" is what the route did before: select(Contact), then List[ResponseContact] validated from attributes
+and encoded with the stdlib json, as FastAPI does for a response_model. "rows" is the current path:
+select(*CONTACT_COLUMNS) and fast_json.
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import Session
+
+from src.database.models import Contact
+from src.repository.contacts import CONTACT_COLUMNS
+from src.routes.contacts import fast_json
+from src.schemas import ResponseContact
+
+SQLITE_CONTACTS = """
+CREATE TABLE contacts (
+    id INTEGER PRIMARY KEY, name VARCHAR, surname VARCHAR, email VARCHAR, phone VARCHAR, birthday DATE,
+    birthday_doy SMALLINT, additional VARCHAR, created_at DATETIME, updated_at DATETIME,
+    search_vector TEXT, user_id INTEGER
+)
+"""
+
+response_adapter = TypeAdapter(List[ResponseContact])
+
+
+def sqlite_engine(rows: int):
+    """
+    The sqlite_engine function creates an in-memory contacts table with rows contacts of user 1.
+
+    :param rows: int: How many contacts to insert
+    :return: The engine
+    :doc-author: Trelent
+    """
+    engine = create_engine("sqlite://")
+    now = datetime(2024, 1, 1, 12, 30, 15, 123456)
+    with engine.begin() as conn:
+        conn.execute(text(SQLITE_CONTACTS))
+        conn.execute(insert(Contact), [
+            {
+                "name": f"Name{index}", "surname": f"Surname{index}", "email": f"contact{index}@example.com",
+                "phone": f"+380{500000000 + index}", "birthday": date(1980, 1, 1) + timedelta(days=index % 9000),
+                "additional": "some notes about the contact", "user_id": 1, "created_at": now, "updated_at": now,
+            }
+            for index in range(rows)
+        ])
+    return engine
+
+
+def orm_page(session: Session, user_id: int, rows: int) -> tuple[float, float]:
+    started = time.perf_counter()
+    contacts = session.execute(select(Contact).filter_by(user_id=user_id).order_by(Contact.id).limit(rows)).scalars().all()
+    fetched = time.perf_counter()
+    content = response_adapter.dump_python(response_adapter.validate_python(contacts, from_attributes=True), mode="json")
+    JSONResponse(content).body
+    encoded = time.perf_counter()
+    # a new session per page, as per request, so the identity map does not serve the next page
+    session.expunge_all()
+    return fetched - started, encoded - fetched
+
+
+def rows_page(session: Session, user_id: int, rows: int) -> tuple[float, float]:
+    started = time.perf_counter()
+    contacts = session.execute(select(*CONTACT_COLUMNS).filter_by(user_id=user_id).order_by(Contact.id).limit(rows)).all()
+    fetched = time.perf_counter()
+    fast_json(Response(), contacts).body
+    encoded = time.perf_counter()
+    return fetched - started, encoded - fetched
+
+
+def measure(engine, user_id: int, rows: int, repeat: int) -> dict:
+    """
+    The measure function reads and encodes the same page repeat times on both paths.
+
+    :param engine: The engine with the contacts
+    :param user_id: int: The owner of the contacts
+    :param rows: int: The page size
+    :param repeat: int: How many pages to time per path, the best half is averaged
+    :return: A dict with milliseconds per 1000 rows for every path and stage
+    :doc-author: Trelent
+    """
+    results = {}
+    with Session(engine) as session:
+        returned = len(session.execute(select(Contact.id).filter_by(user_id=user_id).limit(rows)).all())
+        if not returned:
+            raise SystemExit(f"user {user_id} has no contacts")
+        scale = 1000 * 1000 / returned
+        for name, page in (("orm", orm_page), ("rows", rows_page)):
+            page(session, user_id, rows)
+            timings = sorted((page(session, user_id, rows) for _ in range(repeat)), key=sum)[:max(1, repeat // 2)]
+            fetch = sum(t[0] for t in timings) / len(timings)
+            encode = sum(t[1] for t in timings) / len(timings)
+            results[name] = {
+                "fetch_ms": round(fetch * scale, 2),
+                "encode_ms": round(encode * scale, 2),
+                "total_ms": round((fetch + encode) * scale, 2),
+            }
+    results["rows"] = {**results["rows"], "speedup": round(results["orm"]["total_ms"] / results["rows"]["total_ms"], 2)}
+    return {"page_rows": returned, "per_1000_rows": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="page size")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--url", help="a synchronous database url, an in-memory SQLite table when omitted")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url) if args.url else sqlite_engine(args.rows)
+    report = measure(engine, args.user_id, args.rows, args.repeat)
+    engine.dispose()
+    print(f"{report['page_rows']} rows per page, milliseconds per 1000 rows")
+    print(f"{'path':>5} {'fetch':>8} {'encode':>8} {'total':>8}")
+    for name, result in report["per_1000_rows"].items():
+        print(f"{name:>5} {result['fetch_ms']:>8} {result['encode_ms']:>8} {result['total_ms']:>8}")
+    print(f"rows path is {report['per_1000_rows']['rows']['speedup']}x faster")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
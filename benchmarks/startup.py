@@ -0,0 +1,100 @@
+"""
+Worker cold start benchmark: how long a fresh interpreter takes to import main, build the application
+with create_app and answer the first /openapi.json, with and without a pre-generated OpenAPI document.
+
+    python -m benchmarks.startup --repeat 10
+    python -m benchmarks.startup --openapi openapi.json --json startup.json
+
+Every run is a new process, so nothing is cached in sys.modules; the best half of the runs is averaged.
+Nothing connects to the database or Redis: the engines are created by the startup event, which is not run.
+The report also lists the heavy modules still not imported once the application is built,
+they are loaded by the first request that needs them.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# imported on first use: avatar upload, login or signup, confirmation email, main page
+LAZY_MODULES = ["cloudinary", "PIL.Image", "passlib.context", "jinja2"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app(openapi_path=sys.argv[1])
+created = time.perf_counter()
+app.openapi()
+documented = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_openapi_ms": (documented - created) * 1000,
+    "not_imported": [name for name in sys.argv[2:] if name not in sys.modules],
+}))
+"""
+
+
+def probe(openapi_path: str) -> dict:
+    """
+    The probe function starts a new interpreter and times its import of main, create_app and the first openapi().
+
+    :param openapi_path: str: The pre-generated OpenAPI document, an empty string to generate it
+    :return: A dict with the timings in milliseconds and the modules that were not imported
+    :doc-author: Trelent
+    """
+    env = {**os.environ, "PYTHONWARNINGS": "ignore"}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, openapi_path, *LAZY_MODULES],
+        cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(openapi_path: str, repeat: int) -> dict:
+    runs = sorted((probe(openapi_path) for _ in range(repeat)), key=lambda run: run["import_ms"] + run["create_app_ms"])
+    best = runs[:max(1, repeat // 2)]
+    result = {
+        key: round(sum(run[key] for run in best) / len(best), 1)
+        for key in ("import_ms", "create_app_ms", "first_openapi_ms")
+    }
+    result["cold_start_ms"] = round(result["import_ms"] + result["create_app_ms"], 1)
+    result["not_imported"] = runs[0]["not_imported"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="fresh interpreters per variant")
+    parser.add_argument("--openapi", help="a pre-generated OpenAPI document, written to a temporary file when omitted")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    openapi_path = args.openapi
+    if openapi_path is None:
+        openapi_path = str(Path(tempfile.mkdtemp()) / "openapi.json")
+        subprocess.run([sys.executable, "main.py", "--openapi", openapi_path], cwd=ROOT, check=True, capture_output=True)
+
+    report = {
+        "generated": measure("", args.repeat),
+        "precomputed": measure(str(Path(openapi_path).resolve()), args.repeat),
+    }
+    print("milliseconds per fresh worker")
+    print(f"{'openapi':>12} {'import':>8} {'create':>8} {'cold':>8} {'1st doc':>8}")
+    for name, result in report.items():
+        print(f"{name:>12} {result['import_ms']:>8} {result['create_app_ms']:>8} "
+              f"{result['cold_start_ms']:>8} {result['first_openapi_ms']:>8}")
+    print(f"deferred until first use: {', '.join(report['generated']['not_imported']) or 'none'}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
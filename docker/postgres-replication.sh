@@ -0,0 +1,3 @@
+#!/bin/sh
+# lets the postgres-replica service (docker-compose --profile replica) stream WAL from this server
+echo "host replication all all md5" >> "$PGDATA/pg_hba.conf"
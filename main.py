@@ -1,59 +1,23 @@
-import time
+import argparse
+import json
+from functools import lru_cache
 from pathlib import Path
 
 from fastapi import FastAPI, Depends, HTTPException, status, Request
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
+from fastapi.responses import HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import redis.asyncio as redis
 
-from sqlalchemy import text 
-from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.routes import contacts, auth, users
+from src.database.db import dispose_engines, get_db, init_engines, prewarm_pool, replicas
 from src.conf.config import settings
-
-
-
-app = FastAPI()
-
-
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    """
-    The add_process_time_header function adds a header to the response called My-Process-Time.
-    The value of this header is the time it took for the request to be processed by all middleware and routes.
-    
-    :param request: Request: Access the request object
-    :param call_next: Call the next function in the pipeline
-    :return: A response object with a header called my-process-time
-    :doc-author: Trelent
-    """
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["My-Process-Time"] = str(process_time)
-    return response
-
+from src.services.metrics import MetricsMiddleware, render_metrics
+from src.services.upload_limit import BodySizeLimitMiddleware
 
 
 origins = ["http://localhost:3000", "http://127.0.0.1:5000/"]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
-templates = Jinja2Templates(directory='templates')
-
 
 # Get the absolute path to the current directory of your script
 current_directory = Path(__file__).resolve().parent
@@ -61,50 +25,73 @@ current_directory = Path(__file__).resolve().parent
 # Define the relative path to the 'static' directory from the script's directory
 static_directory = current_directory / 'static'
 
-# app.mount("/static", StaticFiles(directory="static"), name="static")
+
+@lru_cache(maxsize=None)
+def page_templates():
+    # jinja2 is imported on the first page view, not when a worker starts
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory='templates')
 
 
-@app.get("/", response_class=HTMLResponse, description="Main page (description)") # by defolt it is JSONResponse
 def read_root(request: Request):
     """
     The read_root function is a view callable which takes a request and returns
     a response. The root path of the website will be bound to this function, so it
     will execute when requests are made to the root URL of the site.
-    
+
     :param request: Request: Pass the request object to the template
     :return: A templateresponse object
     :doc-author: Trelent
     """
-    return templates.TemplateResponse('index.html', {'request': request, 'title': 'Contacts APP' })
+    return page_templates().TemplateResponse('index.html', {'request': request, 'title': 'Contacts APP' })
+
 
-@app.on_event("startup")
 async def startup():
     """
-    The startup function is called when the application starts up.
-    It's a good place to initialize things that are used by the app, such as caches or databases.
-    
-    :return: A list of coroutines
+    The startup function is called when the application starts, in every worker after the fork.
+    It creates the database engines, opens the first connections, so the first requests do not wait for them,
+    and starts measuring the lag of the read replicas.
+
+    :return: None
     :doc-author: Trelent
     """
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+    init_engines()
+    await prewarm_pool()
+    replicas.start()
 
 
-@app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def shutdown():
+    """
+    The shutdown function is called when the application stops.
+    It closes the pooled SMTP connections of the email sender, stops the replica lag checks
+    and closes the pooled database connections.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    # the sender pulls in aiosmtplib and the auth service, so it is not imported with main
+    from src.services.email import email_sender
+
+    await email_sender.close()
+    await replicas.stop()
+    await dispose_engines()
+
+
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     """
     The healthchecker function is used to check the health of the database.
     It will return a 200 status code if it can successfully connect to the database,
     and a 500 status code otherwise.
-    
-    :param db: Session: Pass the database connection to the function
+
+    :param db: AsyncSession: Pass the database connection to the function
     :return: A dict with a message
     :doc-author: Trelent
     """
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = await db.execute(text("SELECT 1"))
+        result = result.fetchone()
         print(result)
         if result is None:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -116,6 +103,95 @@ def healthchecker(db: Session = Depends(get_db)):
                             detail="Error connecting to the database")
 
 
-app.include_router(contacts.router, prefix='/api')
-app.include_router(auth.router, prefix='/api')
-app.include_router(users.router, prefix='/api')
+async def metrics():
+    """
+    The metrics function exposes the application metrics in the Prometheus text format:
+    HTTP, SQL statement, connection pool, Redis and token cache metrics.
+
+    :return: A plain text response for the Prometheus scraper
+    :doc-author: Trelent
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+def create_app(openapi_path: str | None = None) -> FastAPI:
+    """
+    The create_app function builds the application: middleware, routes and startup/shutdown hooks.
+    Nothing connects here, the database engines are created by the startup event of each worker,
+    so `uvicorn --factory main:create_app` or a forking server never shares pools between processes.
+    When openapi_path names an existing file, that pre-generated OpenAPI document is served
+    instead of building it from the routes on the first /docs or /openapi.json request.
+
+    :param openapi_path: str | None: The OpenAPI document to serve, settings.openapi_path by default
+    :return: The FastAPI application
+    :doc-author: Trelent
+    """
+    from src.routes import contacts, auth, users
+
+    app = FastAPI()
+
+    # the avatar plus room for the multipart boundaries and part headers, checked before the body is spooled
+    app.add_middleware(BodySizeLimitMiddleware, limits={"/api/users/avatar": settings.avatar_max_bytes + 64 * 1024})
+
+    # per-route latency histograms, status counters and in-flight gauges; also sets My-Process-Time
+    app.add_middleware(MetricsMiddleware)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag", "X-RateLimit-Limit", "X-RateLimit-Remaining", "Retry-After"],
+    )
+
+    # app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    if settings.avatar_storage == "local":
+        from fastapi.staticfiles import StaticFiles
+
+        app.mount(settings.avatar_local_url, StaticFiles(directory=settings.avatar_local_dir), name="avatars")
+
+    # by defolt it is JSONResponse
+    app.get("/", response_class=HTMLResponse, description="Main page (description)")(read_root)
+    app.on_event("startup")(startup)
+    app.on_event("shutdown")(shutdown)
+    app.get("/api/healthchecker")(healthchecker)
+    app.get("/metrics", include_in_schema=False)(metrics)
+
+    app.include_router(contacts.router, prefix='/api')
+    app.include_router(auth.router, prefix='/api')
+    app.include_router(users.router, prefix='/api')
+
+    openapi_path = settings.openapi_path if openapi_path is None else openapi_path
+    if openapi_path:
+        try:
+            app.openapi_schema = json.loads(Path(openapi_path).read_bytes())
+        except (OSError, ValueError) as err:
+            print(err)
+    return app
+
+
+def __getattr__(name: str):
+    # `uvicorn main:app` still works, the application is built on first access instead of at import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contacts API utilities")
+    parser.add_argument("--openapi", metavar="PATH", required=True,
+                        help="write the OpenAPI document of the routes to PATH, to be served via OPENAPI_PATH")
+    args = parser.parse_args()
+
+    document = create_app(openapi_path="").openapi()
+    Path(args.openapi).write_text(json.dumps(document, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{len(document['paths'])} paths written to {args.openapi}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""contacts search
+
+Revision ID: e41d7b0a93c5
+Revises: 9f2c4a61e8d3
+Create Date: 2026-10-17 14:05:27.913846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41d7b0a93c5'
+down_revision: Union[str, None] = '9f2c4a61e8d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_TEXT = (
+    "coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(email, '') || ' ' || "
+    "coalesce(phone, '') || ' ' || coalesce(additional, '')"
+)
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    op.add_column('contacts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(f"to_tsvector('simple', {SEARCH_TEXT})", ), nullable=True))
+    # CREATE / DROP INDEX CONCURRENTLY cannot run in a transaction; built this way the indexes
+    # do not block writes to contacts for the whole build
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contacts_user_id_search_vector', 'contacts', ['user_id', 'search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+        op.execute(f'CREATE INDEX CONCURRENTLY ix_contacts_user_id_search_trgm ON contacts USING gin (user_id, ({SEARCH_TEXT}) gin_trgm_ops)')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contacts_user_id_search_trgm', table_name='contacts', postgresql_concurrently=True)
+        op.drop_index('ix_contacts_user_id_search_vector', table_name='contacts', postgresql_using='gin', postgresql_concurrently=True)
+    op.drop_column('contacts', 'search_vector')
@@ -1,34 +1,490 @@
-from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from src.conf.config import settings
+from src.services.cache import read_your_writes
+from src.services.metrics import DB_ADMISSION_REJECTED, TimedAsyncQueuePool, TimedQueuePool, instrument_engine
 
 URI = settings.sqlalchemy_database_url
+logger = logging.getLogger(__name__)
 
-engine = create_engine(URI, echo=False, pool_size=5)
+ASYNC_URI = settings.sqlalchemy_async_database_url or make_url(URI).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
 
-# Dependency
+class SyncResultAdapter:
+    """
+    Wraps a streaming synchronous Result in the AsyncResult API used by the repository layer.
+    Each partition is fetched from the server-side cursor in the threadpool.
+    """
+
+    def __init__(self, sync_result):
+        self.sync_result = sync_result
 
+    async def partitions(self, size: int | None = None):
+        partitions = self.sync_result.partitions(size)
+        while True:
+            rows = await run_in_threadpool(next, partitions, None)
+            if rows is None:
+                break
+            yield rows
 
-def get_db():
+    async def close(self):
+        await run_in_threadpool(self.sync_result.close)
+
+
+class SyncSessionAdapter:
+    """
+    Wraps a synchronous Session in the awaitable AsyncSession API, so the repository layer is written once.
+    Every call that may touch the database runs in the threadpool instead of blocking the event loop.
     """
-    The get_db function is a context manager that will automatically close the database connection when it goes out of scope.
-    It also handles any exceptions that occur within the with block, rolling back changes if necessary.
 
-    :return: A generator, which is a function that returns an object on which you can call next,
+    def __init__(self, sync_session: Session):
+        self.sync_session = sync_session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def stream(self, statement, params=None, **kwargs):
+        kwargs["execution_options"] = {**kwargs.get("execution_options", {}), "stream_results": True}
+        result = await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+        return SyncResultAdapter(result)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.sync_session.refresh, instance)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class PoolAdmissionError(PoolTimeoutError):
+    """
+    A checkout refused at once because the pool and its wait queue are full.
+    It is a pool timeout that did not wait, so session_scope answers both with 503.
+    """
+
+
+class AdmissionController:
+    """
+    Bounds the checkouts that hold or wait for a pooled connection.
+    Once every connection of the pool is in use and queue_limit more checkouts are already waiting,
+    new checkouts fail at once instead of queueing until the pool timeout,
+    so latency stays bounded when the database is saturated.
+    Requests that never touch the database (cached users, 304 answers) take no place.
+    Synchronous sessions check out in the threadpool, so the counter is locked.
+    """
+
+    def __init__(self, capacity: int, queue_limit: int):
+        self.limit = capacity + queue_limit
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def admit(self) -> None:
+        """
+        The admit function takes a place for the checkout, or raises PoolAdmissionError when there is none left.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        with self.lock:
+            if self.active >= self.limit:
+                raise PoolAdmissionError(f"{self.active} connections checked out or waiting, retry later")
+            self.active += 1
+
+    def release(self) -> None:
+        with self.lock:
+            self.active -= 1
+
+
+class AdmittedPoolMixin:
+    """
+    Takes an admission place for every connection checked out of the pool and gives it back at checkin.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.admission = AdmissionController(settings.db_pool_size + settings.db_max_overflow, settings.db_queue_limit)
+
+    def _do_get(self):
+        self.admission.admit()
+        try:
+            return super()._do_get()
+        except BaseException:
+            self.admission.release()
+            raise
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self.admission.release()
+
+
+class AdmittedQueuePool(AdmittedPoolMixin, TimedQueuePool):
+    pass
+
+
+class AdmittedAsyncQueuePool(AdmittedPoolMixin, TimedAsyncQueuePool):
+    pass
+
+
+def busy() -> HTTPException:
+    DB_ADMISSION_REJECTED.inc()
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is busy, retry later",
+                         headers={"Retry-After": str(settings.db_retry_after)})
+
+
+POOL_OPTIONS = {
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout,
+    "pool_recycle": settings.db_pool_recycle,
+    "pool_pre_ping": settings.db_pool_pre_ping,
+}
+
+def make_engine(uri: str):
+    if settings.sqlalchemy_async_mode:
+        return create_async_engine(uri, echo=False, poolclass=AdmittedAsyncQueuePool, **POOL_OPTIONS)
+    return create_engine(uri, echo=False, poolclass=AdmittedQueuePool, **POOL_OPTIONS)
+
+
+def replica_uri(uri: str) -> str:
+    if not settings.sqlalchemy_async_mode:
+        return uri
+    return make_url(uri).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+# built by init_engines in the worker process, never at import: a pool created before the server
+# forks its workers would be shared by all of them
+engine = None
+DBSession = None
+
+
+# seconds the replica is behind the primary, 0 once it has replayed everything it received
+REPLICA_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """
+    Spreads read sessions over the replicas round-robin.
+    A background task measures the replication lag of every replica; a replica behind by more than
+    max_lag, or one that cannot be reached, is skipped until it catches up, and with none left
+    the reads go to the primary. Only the changes of reachability are logged, not every failed check.
+    """
+
+    def __init__(self, engines: list, max_lag: float, interval: float):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.interval = interval
+        # unknown until the first check, so the reads start on the primary
+        self.lags = [float("inf")] * len(engines)
+        self.down = [False] * len(engines)
+        self.counter = itertools.count()
+        self.task = None
+
+    def bind(self, engines: list) -> None:
+        self.engines = engines
+        self.lags = [float("inf")] * len(engines)
+        self.down = [False] * len(engines)
+
+    async def lag(self, replica) -> float:
+        """
+        The lag function reads how far behind the primary the replica is.
+
+        :param self: Represent the instance of the class
+        :param replica: The Engine or AsyncEngine of the replica
+        :return: The lag in seconds
+        :doc-author: Trelent
+        """
+        if settings.sqlalchemy_async_mode:
+            async with replica.connect() as connection:
+                return float(await connection.scalar(REPLICA_LAG))
+
+        def query():
+            with replica.connect() as connection:
+                return float(connection.scalar(REPLICA_LAG))
+
+        return await run_in_threadpool(query)
+
+    async def check(self) -> None:
+        for index, replica in enumerate(self.engines):
+            try:
+                self.lags[index] = await self.lag(replica)
+            except (SQLAlchemyError, OSError) as err:
+                if not self.down[index]:
+                    logger.warning("replica%d is unreachable, its reads go elsewhere: %s", index, err)
+                self.down[index] = True
+                self.lags[index] = float("inf")
+                continue
+            if self.down[index]:
+                logger.warning("replica%d is reachable again", index)
+                self.down[index] = False
+
+    async def run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.engines and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def pick(self):
+        """
+        The pick function returns the next replica that is not lagging too far behind.
+
+        :param self: Represent the instance of the class
+        :return: The engine of the replica, or None to read from the primary
+        :doc-author: Trelent
+        """
+        for _ in range(len(self.engines)):
+            index = next(self.counter) % len(self.engines)
+            if self.lags[index] <= self.max_lag:
+                return self.engines[index]
+        return None
+
+
+replicas = ReplicaRouter([], settings.db_replica_max_lag, settings.db_replica_check_interval)
+
+
+def token_subject(request: Request) -> str | None:
+    """
+    The token_subject function reads the sub claim of the bearer token without verifying it.
+    It only chooses where the reads go, get_current_user still verifies the token.
+
+    :param request: Request: The incoming request
+    :return: The email of the user, or None
+    :doc-author: Trelent
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    # jose (and the cryptography backend it loads) is imported by the first authenticated read, not with main
+    from jose import JWTError, jwt
+
+    try:
+        return jwt.get_unverified_claims(token).get("sub")
+    except JWTError:
+        return None
+
+
+def init_engines() -> None:
+    """
+    The init_engines function creates the engines of the primary and of the replicas on first use.
+    The startup event calls it, so the pools belong to the worker that serves the requests,
+    and sessions opened before that (scripts, tests) create them on demand.
+
+    :return: None
     :doc-author: Trelent
     """
+    global engine, DBSession
+    if DBSession is not None:
+        return
+    if settings.sqlalchemy_async_mode:
+        engine = make_engine(ASYNC_URI)
+        DBSession = async_sessionmaker(bind=engine, expire_on_commit=False)
+    else:
+        engine = make_engine(URI)
+        DBSession = sessionmaker(bind=engine, expire_on_commit=False)
+    instrument_engine(engine)
+    replica_engines = [make_engine(replica_uri(uri.strip())) for uri in settings.sqlalchemy_replica_urls.split(",") if uri.strip()]
+    for number, replica_engine in enumerate(replica_engines):
+        instrument_engine(replica_engine, f"replica{number}")
+    replicas.bind(replica_engines)
 
-    db = DBSession()
+
+async def dispose_engines() -> None:
+    """
+    The dispose_engines function closes the pooled connections of the primary and of the replicas at shutdown.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    for current in [engine, *replicas.engines]:
+        if current is None:
+            continue
+        if settings.sqlalchemy_async_mode:
+            await current.dispose()
+        else:
+            await run_in_threadpool(current.dispose)
+
+
+async def prewarm_pool(connections: int = settings.db_pool_prewarm) -> None:
+    """
+    The prewarm_pool function opens connections at startup and returns them to the pool,
+    so the first requests do not pay for the connection handshakes.
+    A database that is not reachable yet is logged, not fatal; the connections that did open are returned either way.
+
+    :param connections: int: How many connections to open, at most the pool size is kept
+    :return: None
+    :doc-author: Trelent
+    """
+    init_engines()
+    connections = min(connections, settings.db_pool_size)
+    if connections <= 0:
+        return
+    if settings.sqlalchemy_async_mode:
+        opened = await asyncio.gather(*(engine.connect() for _ in range(connections)), return_exceptions=True)
+    else:
+        opened = await asyncio.gather(*(run_in_threadpool(engine.connect) for _ in range(connections)), return_exceptions=True)
+    for connection in opened:
+        if isinstance(connection, BaseException):
+            continue
+        if settings.sqlalchemy_async_mode:
+            await connection.close()
+        else:
+            await run_in_threadpool(connection.close)
+    errors = [error for error in opened if isinstance(error, BaseException)]
+    for error in errors:
+        if not isinstance(error, (SQLAlchemyError, OSError)):
+            raise error
+    if errors:
+        logger.warning("prewarmed %d of %d connections: %s", connections - len(errors), connections, errors[0])
+
+
+@asynccontextmanager
+async def session_scope(bind=None):
+    """
+    The session_scope function opens a session on bind (the primary by default) and always closes it.
+    In async mode it yields an AsyncSession, otherwise the synchronous Session wrapped in SyncSessionAdapter,
+    so the callers always await the same API. A pool checkout that times out or is refused is answered 503.
+
+    :param bind: The engine of a replica, None for the primary
+    :return: An async context manager yielding the session
+    :doc-author: Trelent
+    """
+    init_engines()
+    db = DBSession() if bind is None else DBSession(bind=bind)
+    if not isinstance(db, AsyncSession):
+        db = SyncSessionAdapter(db)
     try:
         yield db
+    except PoolTimeoutError:
+        await db.rollback()
+        raise busy()
     except SQLAlchemyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
-        db.close()
+        await db.close()
+
+
+@asynccontextmanager
+async def primary_session(request: Request, shared: bool = True):
+    """
+    The primary_session function opens the session on the primary, at most one per request:
+    get_db and a get_read_db that fell back to the primary share it, so a request never holds two connections.
+    A session that outlives the dependencies (a streamed body) is opened with shared=False.
+
+    :param request: Request: The request the session belongs to
+    :param shared: bool: Reuse and publish the session of the request through request.state
+    :return: An async context manager yielding the session
+    :doc-author: Trelent
+    """
+    db = getattr(request.state, "primary_db", None) if shared else None
+    if db is not None:
+        yield db
+        return
+    async with session_scope() as db:
+        if shared:
+            request.state.primary_db = db
+        yield db
+
+
+@asynccontextmanager
+async def read_session(request: Request, shared: bool = True):
+    """
+    The read_session function opens the session of a read-only request.
+    With replicas configured the session goes to the next replica that is not lagging,
+    unless the user has written within the last few seconds: then it stays on the primary,
+    so users always read their own writes.
+
+    :param request: Request: Identify the user from the bearer token
+    :param shared: bool: Share the primary session with the other dependencies of the request, see primary_session
+    :return: An async context manager yielding the session
+    :doc-author: Trelent
+    """
+    init_engines()
+    replica = None
+    if replicas.engines:
+        subject = token_subject(request)
+        if subject is None or not await read_your_writes.recent(subject):
+            replica = replicas.pick()
+    scope = primary_session(request, shared) if replica is None else session_scope(replica)
+    async with scope as db:
+        yield db
+
+# Dependency
+
+
+async def get_db(request: Request):
+    """
+    The get_db function is a context manager that will automatically close the database connection when it goes out of scope.
+    It also handles any exceptions that occur within the with block, rolling back changes if necessary.
+    The session is on the primary; its first query is answered 503 when the pool is saturated, see AdmissionController.
+
+    :param request: Request: The request the session belongs to
+    :return: A generator, which is a function that returns an object on which you can call next,
+    :doc-author: Trelent
+    """
+    async with primary_session(request) as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    """
+    The get_read_db function is the session dependency of read-only routes and of get_current_user,
+    the session goes to a replica or stays on the primary as read_session decides.
+
+    :param request: Request: Identify the user from the bearer token
+    :return: A generator yielding the session
+    :doc-author: Trelent
+    """
+    async with read_session(request) as db:
+        yield db
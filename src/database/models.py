@@ -1,8 +1,15 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, func, Date, Boolean
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, func, Date, Boolean, Index, SmallInteger, Computed, cast, extract, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, declarative_base, deferred
 
 Base = declarative_base()
 
+# every searchable field of a contact in one string; queries use the same text so the trigram index matches
+CONTACT_SEARCH_TEXT = (
+    "coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(email, '') || ' ' || "
+    "coalesce(phone, '') || ' ' || coalesce(additional, '')"
+)
+
 
 class Contact(Base):
     __tablename__ = "contacts"
@@ -12,12 +19,33 @@ class Contact(Base):
     email = Column(String, unique=True, index=True)
     phone = Column(String, default="None", nullable=False)
     birthday = Column(Date, default=None, nullable=True)
+    # day of the birthday in a leap year (Feb 29 = 60, Dec 31 = 366), so windows are plain integer ranges
+    birthday_doy = Column(SmallInteger, Computed(
+        275 * cast(extract("month", birthday), Integer) // 9
+        - (cast(extract("month", birthday), Integer) + 9) // 12
+        + cast(extract("day", birthday), Integer) - 30
+    ))
     additional = Column(String, default="None", nullable=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    search_vector = deferred(Column(TSVECTOR, Computed(f"to_tsvector('simple', {CONTACT_SEARCH_TEXT})")))
     user_id = Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), default=None)
     user = relationship("User", backref="notes")
 
+    # keyset pagination: WHERE user_id = ? AND (sort key, id) > (?, ?) ORDER BY sort key NULLS LAST, id;
+    # ascending btree indexes already keep NULLs last, so they match that order
+    __table_args__ = (
+        Index("ix_contacts_user_id_id", "user_id", "id"),
+        Index("ix_contacts_user_id_name_id", "user_id", "name", "id"),
+        Index("ix_contacts_user_id_surname_id", "user_id", "surname", "id"),
+        Index("ix_contacts_user_id_birthday_id", "user_id", "birthday", "id"),
+        Index("ix_contacts_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_contacts_user_id_birthday_doy", "user_id", "birthday_doy"),
+        # full-text and fuzzy search, GIN over (user_id, ...) needs the btree_gin and pg_trgm extensions
+        Index("ix_contacts_user_id_search_vector", "user_id", "search_vector", postgresql_using="gin"),
+        Index("ix_contacts_user_id_search_trgm", "user_id", text(f"({CONTACT_SEARCH_TEXT}) gin_trgm_ops"), postgresql_using="gin"),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -28,4 +56,6 @@ class User(Base):
     created_at = Column("crated_at", DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
     refresh_token = Column(String(255), nullable=True)
-    confirmed = Column(Boolean, default=False)
\ No newline at end of file
+    confirmed = Column(Boolean, default=False)
+    # kept in step by every contact insert and delete, so listings get their total without COUNT(*)
+    contacts_count = Column(Integer, nullable=False, default=0, server_default="0")
\ No newline at end of file
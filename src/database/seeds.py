@@ -1,31 +1,238 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+"""
+Seed the database with N users and M contacts per user, the same rows for the same --seed.
+
+    alembic upgrade head
+    python -m src.database.seeds --users 1000 --contacts 1000 --seed 42 --workers 4
+
+Contacts are generated in worker processes, user by user, from a Faker vocabulary built once per
+process; every user gets its own random.Random seeded with (seed, user number), so the data does not
+depend on --workers. On PostgreSQL (psycopg2) the contacts are loaded with COPY, other databases get
+batched multi-row INSERTs. All seeded users are confirmed and share the --password.
+"""
+import argparse
+import csv
+import io
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
 from faker import Faker
+from passlib.context import CryptContext
+from sqlalchemy import create_engine, insert
+
+from src.conf.config import settings
+from src.database.models import Contact, User
+
+COPY_COLUMNS = ("name", "surname", "email", "phone", "birthday", "additional", "user_id", "created_at", "updated_at")
+# birthdays fall in a fixed range, not relative to today, so a seed always yields the same rows
+OLDEST_BIRTHDAY = date(1958, 1, 1)
+BIRTHDAY_DAYS = 365 * 48
+
+
+@lru_cache(maxsize=4)
+def vocabulary(seed: int, locale: str) -> dict:
+    """
+    The vocabulary function generates the names and words contacts are made of, once per process.
+    Picking from these lists is far cheaper than calling Faker for every field of every row.
+
+    :param seed: int: Seeds Faker
+    :param locale: str: The Faker locale
+    :return: A dict of word lists
+    :doc-author: Trelent
+    """
+    fake = Faker(locale)
+    fake.seed_instance(seed)
+    return {
+        "first_names": [fake.first_name() for _ in range(2000)],
+        "last_names": [fake.last_name() for _ in range(2000)],
+        "words": [fake.word() for _ in range(1000)],
+        "domains": [fake.free_email_domain() for _ in range(20)],
+    }
+
+
+def user_row(seed: int, number: int, password: str, contacts: int) -> dict:
+    return {
+        "username": f"seed{seed}_user{number}"[:50],
+        "email": f"seed{seed}.user{number}@example.com",
+        "password": password,
+        "confirmed": True,
+        "contacts_count": contacts,
+    }
+
+
+def contact_rows(seed: int, locale: str, number: int, user_id: int, contacts: int) -> list[tuple]:
+    """
+    The contact_rows function generates the contacts of one user.
+
+    :param seed: int: The seed of the run
+    :param locale: str: The Faker locale
+    :param number: int: The number of the user, with the seed it determines the rows
+    :param user_id: int: The id of the user in the database
+    :param contacts: int: How many contacts to generate
+    :return: A list of tuples in the COPY_COLUMNS order, without the timestamps
+    :doc-author: Trelent
+    """
+    words = vocabulary(seed, locale)
+    rng = random.Random(f"{seed}:{number}")
+    rows = []
+    for index in range(contacts):
+        name = rng.choice(words["first_names"])
+        surname = rng.choice(words["last_names"])
+        rows.append((
+            name,
+            surname,
+            f"{index}.u{number}.s{seed}@{rng.choice(words['domains'])}",
+            f"+380{rng.randrange(10 ** 8, 10 ** 9)}",
+            OLDEST_BIRTHDAY + timedelta(days=rng.randrange(BIRTHDAY_DAYS)),
+            " ".join(rng.choices(words["words"], k=3)),
+            user_id,
+        ))
+    return rows
+
+
+def generate(job: tuple) -> list[tuple]:
+    return contact_rows(*job)
+
+
+def bounded_map(executor, fn, jobs, window: int):
+    """
+    The bounded_map function is executor.map with at most window jobs submitted ahead of the consumer.
+    executor.map submits every job up front, so the generated rows would pile up in memory
+    whenever the workers produce them faster than the database loads them.
+    The results come in the order of the jobs, which keeps the contact ids the same for the same seed.
+
+    :param executor: The process pool
+    :param fn: The function to run
+    :param jobs: An iterable of the arguments of fn
+    :param window: int: How many jobs may be in flight
+    :return: A generator of the results
+    :doc-author: Trelent
+    """
+    in_flight = deque()
+    for job in jobs:
+        in_flight.append(executor.submit(fn, job))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def copy_contacts(engine, rows: list[tuple], now: datetime) -> None:
+    """
+    The copy_contacts function loads contacts with COPY ... FROM STDIN, one transaction per call.
+
+    :param engine: The psycopg2 engine
+    :param rows: list[tuple]: The rows from contact_rows
+    :param now: datetime: created_at and updated_at of the rows
+    :return: None
+    :doc-author: Trelent
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row + (now, now))
+    buffer.seek(0)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY contacts ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def insert_contacts(engine, rows: list[tuple], now: datetime) -> None:
+    """
+    The insert_contacts function loads contacts with a batched INSERT, for databases without COPY.
+
+    :param engine: The engine
+    :param rows: list[tuple]: The rows from contact_rows
+    :param now: datetime: created_at and updated_at of the rows
+    :return: None
+    :doc-author: Trelent
+    """
+    with engine.begin() as conn:
+        conn.execute(insert(Contact), [dict(zip(COPY_COLUMNS, row + (now, now))) for row in rows])
+
+
+def seed(url: str, users: int, contacts: int, seed: int = 0, workers: int = 1, batch_size: int = 50000,
+         locale: str = "uk_UA", password: str = "password") -> dict:
+    """
+    The seed function creates the users, then generates their contacts in worker processes and loads them
+    in batches of batch_size rows.
+
+    :param url: str: The database url
+    :param users: int: How many users to create
+    :param contacts: int: How many contacts every user gets
+    :param seed: int: Makes the run reproducible, and the emails unique per seed
+    :param workers: int: The number of generating processes
+    :param batch_size: int: Rows per COPY / INSERT
+    :param locale: str: The Faker locale
+    :param password: str: The password of every seeded user
+    :return: A dict with row counts, timings and rows per second
+    :doc-author: Trelent
+    """
+    engine = create_engine(url)
+    load = copy_contacts if engine.dialect.driver == "psycopg2" else insert_contacts
+    hashed = CryptContext(schemes=["bcrypt"], bcrypt__rounds=settings.bcrypt_rounds).hash(password)
+    now = datetime.now()
 
-from models import Base, Contact
-from db import URI
+    started = time.perf_counter()
+    user_ids = []
+    with engine.begin() as conn:
+        for first in range(0, users, batch_size):
+            rows = [user_row(seed, number, hashed, contacts) for number in range(first, min(users, first + batch_size))]
+            result = conn.execute(insert(User).returning(User.id, sort_by_parameter_order=True), rows)
+            user_ids.extend(result.scalars().all())
+    users_seconds = time.perf_counter() - started
 
+    started = time.perf_counter()
+    jobs = ((seed, locale, number, user_id, contacts) for number, user_id in enumerate(user_ids))
+    loaded = 0
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for rows in bounded_map(executor, generate, jobs, 2 * workers):
+            pending.extend(rows)
+            if len(pending) >= batch_size:
+                load(engine, pending, now)
+                loaded += len(pending)
+                pending = []
+    if pending:
+        load(engine, pending, now)
+        loaded += len(pending)
+    contacts_seconds = time.perf_counter() - started
+    engine.dispose()
 
-engine = create_engine(URI)
-Session = sessionmaker(bind=engine)
-session = Session()
+    return {
+        "users": len(user_ids),
+        "contacts": loaded,
+        "users_seconds": round(users_seconds, 2),
+        "contacts_seconds": round(contacts_seconds, 2),
+        "contacts_per_second": round(loaded / contacts_seconds, 1) if contacts_seconds else 0.0,
+        "method": "copy" if load is copy_contacts else "insert",
+    }
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine)
 
-fake = Faker('uk_UA')
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--contacts", type=int, default=100, help="contacts per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--locale", default="uk_UA")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--url", default=settings.sqlalchemy_database_url)
+    args = parser.parse_args()
 
-# Create 40 fake contacts and insert them into the database
-for _ in range(40):
-    contact = Contact(
-        name=fake.first_name(),
-        surname=fake.last_name(),
-        email=fake.email(),
-        phone=fake.phone_number(),
-        birthday=fake.date_of_birth(minimum_age=18, maximum_age=65),
-        additional=fake.text(max_nb_chars=20),  # Limit text to 20 characters
-    )
+    report = seed(args.url, args.users, args.contacts, args.seed, args.workers, args.batch_size, args.locale, args.password)
+    print(f"{report['users']} users in {report['users_seconds']} s, "
+          f"{report['contacts']} contacts in {report['contacts_seconds']} s "
+          f"({report['contacts_per_second']} rows/s, {report['method']})")
 
-    session.add(contact)
 
-session.commit()
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,189 @@
-from datetime import date, timedelta
-from sqlalchemy import and_, extract, or_, between
-from sqlalchemy.orm import Session
+import base64
+import json
+import re
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import and_, or_, select, update, delete, case, tuple_, func, literal, literal_column, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Contact, User
-from src.schemas import ContactModel
+from src.database.models import Contact, User, CONTACT_SEARCH_TEXT
+from src.schemas import ContactModel, ContactPatch, ContactSort
+from src.services.cache import birthday_cache, contact_versions, read_your_writes
 
 
-async def get_all_contacts(limit: int, offset: int, current_user: User, db: Session):
+# the columns ResponseContact is built from, returned by the writes so no reload is needed
+CONTACT_COLUMNS = (
+    Contact.id, Contact.name, Contact.surname, Contact.email, Contact.phone, Contact.birthday,
+    Contact.additional, Contact.created_at, Contact.updated_at,
+)
+
+def contact_columns(fields: tuple[str, ...] | None = None, sort: str = "id") -> tuple:
+    """
+    The contact_columns function turns a sparse fieldset into the SELECT list.
+    id and the sort key are always selected, the next page cursor is built from them.
+
+    :param fields: tuple[str, ...] | None: The ResponseContact fields asked for, None for all of them
+    :param sort: str: The sort order of the page
+    :return: A tuple of Contact columns
+    :doc-author: Trelent
+    """
+    if fields is None:
+        return CONTACT_COLUMNS
+    names = dict.fromkeys(("id", *fields, ContactSort(sort).value))
+    return tuple(getattr(Contact, name) for name in names)
+
+
+SORT_COLUMNS = {
+    ContactSort.id: Contact.id,
+    ContactSort.name: Contact.name,
+    ContactSort.surname: Contact.surname,
+    ContactSort.birthday: Contact.birthday,
+    ContactSort.created_at: Contact.created_at,
+}
+
+
+def day_of_year(day: date) -> int:
+    """
+    The day_of_year function returns the position of the day in a leap year,
+    the same numbering Contact.birthday_doy is computed with (Feb 29 = 60, Dec 31 = 366).
+
+    :param day: date: Any date
+    :return: The day number between 1 and 366
+    :doc-author: Trelent
+    """
+    return date(2000, day.month, day.day).timetuple().tm_yday
+
+
+def encode_cursor(contact: Contact, sort: str = "id") -> str:
+    """
+    The encode_cursor function builds an opaque keyset cursor pointing right after the given contact.
+    The cursor stores the sort key, the value of the sorted column and the contact id.
+
+    :param contact: Contact: The last contact of the current page
+    :param sort: str: The sort order the page was built with
+    :return: A url-safe base64 string
+    :doc-author: Trelent
+    """
+    sort = ContactSort(sort)
+    value = getattr(contact, sort.value)
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    payload = json.dumps([sort.value, value, contact.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str = "id") -> tuple:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor.
+    It raises ValueError if the cursor is malformed or was issued for another sort order.
+
+    :param cursor: str: The cursor received from the client
+    :param sort: str: The sort order of the requested page
+    :return: A tuple of the sorted column value and the contact id
+    :doc-author: Trelent
+    """
+    sort = ContactSort(sort)
+    try:
+        cursor_sort, value, contact_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as err:
+        raise ValueError("Invalid cursor") from err
+    if cursor_sort != sort.value or not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor")
+    if value is not None and sort == ContactSort.birthday:
+        value = date.fromisoformat(value)
+    elif value is not None and sort == ContactSort.created_at:
+        value = datetime.fromisoformat(value)
+    return value, contact_id
+
+
+def next_cursor(contacts: list[Contact], limit: int, sort: str = "id") -> str | None:
+    """
+    The next_cursor function returns the cursor of the page that follows the given one,
+    or None when the page is not full and there is nothing more to read.
+
+    :param contacts: list[Contact]: The contacts of the current page
+    :param limit: int: The page size that was requested
+    :param sort: str: The sort order of the page
+    :return: A cursor string or None
+    :doc-author: Trelent
+    """
+    if not contacts or len(contacts) < limit:
+        return None
+    return encode_cursor(contacts[-1], sort)
+
+
+def paginate(stmt, limit: int, offset: int, sort: str = "id", cursor: str | None = None):
+    """
+    The paginate function orders a contacts query by (sort key, id) and applies the page window.
+    With a cursor it seeks past the last seen row, so it is served by the (user_id, sort key, id)
+    indexes and every page costs the same; without one it falls back to limit/offset.
+    The sort keys other than id are nullable: contacts without a value come last (NULLS LAST, the order
+    of the indexes). A cursor on a value seeks the rows after it and, in a second branch of a UNION ALL,
+    the first rows without a value; a cursor on NULL continues by id among those.
+
+    :param stmt: Select: The query to paginate
+    :param limit: int: The page size
+    :param offset: int: The number of records to skip when no cursor is given
+    :param sort: str: The sort order
+    :param cursor: str | None: The cursor returned with the previous page
+    :return: The paginated query
+    :doc-author: Trelent
+    """
+    sort = ContactSort(sort)
+    column = SORT_COLUMNS[sort]
+    if sort == ContactSort.id:
+        stmt = stmt.order_by(Contact.id)
+    else:
+        stmt = stmt.order_by(column.asc().nulls_last(), Contact.id)
+    if cursor is None:
+        return stmt.limit(limit).offset(offset)
+    value, contact_id = decode_cursor(cursor, sort)
+    if sort == ContactSort.id:
+        return stmt.filter(Contact.id > contact_id).limit(limit)
+    if value is None:
+        return stmt.filter(column.is_(None), Contact.id > contact_id).limit(limit)
+    # an OR of the seek and the NULL rows could not use the index range, so both are separate
+    # index-ordered, LIMITed branches and only their at most 2 * limit rows are sorted
+    seek = stmt.filter(tuple_(column, Contact.id) > tuple_(value, contact_id)).limit(limit).subquery()
+    nulls = stmt.filter(column.is_(None)).order_by(None).order_by(Contact.id).limit(limit).subquery()
+    page = union_all(select(*seek.c), select(*nulls.c)).subquery()
+    return select(*page.c).order_by(page.c[column.key].asc().nulls_last(), page.c.id).limit(limit)
+
+
+def count_contacts(user_id: int, delta: int):
+    """
+    The count_contacts function builds the UPDATE that moves the contacts counter of the user by delta.
+    It runs in the transaction of the write it accounts for, so the counter is exact.
+
+    :param user_id: int: The owner of the inserted or deleted contacts
+    :param delta: int: The number of inserted contacts, negative for deleted ones
+    :return: The UPDATE statement
+    :doc-author: Trelent
+    """
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(contacts_count=User.contacts_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_contacts_total(current_user: User, db: AsyncSession) -> int:
+    """
+    The get_contacts_total function returns the number of contacts of the user from the counter column,
+    a primary key lookup instead of a COUNT(*) over all of the user's contacts.
+
+    :param current_user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The number of contacts
+    :doc-author: Trelent
+    """
+    total = await db.scalar(select(User.contacts_count).where(User.id == current_user.id))
+    return total or 0
+
+
+async def get_all_contacts(limit: int, offset: int, current_user: User, db: AsyncSession, sort: str = "id", cursor: str | None = None,
+                           fields: tuple[str, ...] | None = None):
     """
     The get_all_contacts function returns a list of contacts for the current user.
         
@@ -14,35 +191,60 @@ async def get_all_contacts(limit: int, offset: int, current_user: User, db: Sess
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Specify the number of records to skip
     :param current_user: User: Get the current user from the database
-    :param db: Session: Access the database
-    :return: A list of contacts, which is then passed to the response_model
+    :param db: AsyncSession: Access the database
+    :param sort: str: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for, instead of using offset
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A list of rows with the columns of ResponseContact, no ORM instances are built
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter_by(user_id=current_user.id)
-    contacts = contacts.limit(limit).offset(offset).all()
-    return contacts
+    stmt = paginate(select(*contact_columns(fields, sort)).filter_by(user_id=current_user.id), limit, offset, sort, cursor)
+    contacts = await db.execute(stmt)
+    return contacts.all()
 
-async def get_contact_by_id(contact_id: int, current_user: User, db: Session):
+async def get_contact_by_id(contact_id: int, current_user: User, db: AsyncSession, fields: tuple[str, ...] | None = None, with_updated_at: bool = False):
     """
     The get_contact_by_id function returns a contact by its id.
         Args:
             contact_id (int): The id of the contact to be returned.
             current_user (User): The user who is making the request for a specific contact.
-            db (Session): A database session object that allows us to query and manipulate data in our database.
+            db (AsyncSession): A database session object that allows us to query and manipulate data in our database.
         Returns: 
             Contact: A single Contact object from our database, or None if no such Contact exists.
     
     :param contact_id: int: Get the contact from the database
     :param current_user: User: Get the user id of the current user
-    :param db: Session: Pass the database session to the function
-    :return: A contact object
+    :param db: AsyncSession: Pass the database session to the function
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :param with_updated_at: bool: Also select updated_at, the ETag is built from it
+    :return: A row with the selected columns, or None
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(id=contact_id).first()
-    return contact
+    columns = contact_columns(fields)
+    if with_updated_at and fields is not None and "updated_at" not in fields:
+        columns += (Contact.updated_at,)
+    stmt = select(*columns).filter_by(id=contact_id, user_id=current_user.id)
+    contact = await db.execute(stmt)
+    return contact.first()
+
+
+async def get_contact_updated_at(contact_id: int, current_user: User, db: AsyncSession) -> datetime | None:
+    """
+    The get_contact_updated_at function reads only the updated_at column of a contact of the user,
+    which is all a conditional GET needs to decide on 304 Not Modified.
+
+    :param contact_id: int: The id of the contact
+    :param current_user: User: The owner of the contact
+    :param db: AsyncSession: Access the database
+    :return: The time of the last change, or None if there is no such contact
+    :doc-author: Trelent
+    """
+    stmt = select(Contact.updated_at).filter_by(id=contact_id, user_id=current_user.id)
+    return await db.scalar(stmt)
 
 
-async def get_contact_by_name(contact_name: str, limit: int, offset: int, current_user: User, db: Session):
+async def get_contact_by_name(contact_name: str, limit: int, offset: int, current_user: User, db: AsyncSession, sort: str = "id", cursor: str | None = None,
+                              fields: tuple[str, ...] | None = None):
     """
     The get_contact_by_name function returns a list of contacts that match the contact_name parameter.
     The limit and offset parameters are used to paginate the results. The current_user parameter is used to ensure that only
@@ -52,15 +254,20 @@ async def get_contact_by_name(contact_name: str, limit: int, offset: int, curren
     :param limit: int: Limit the number of results returned
     :param offset: int: Skip the first n records
     :param current_user: User: Ensure that the user is only able to access their own contacts
-    :param db: Session: Access the database
-    :return: A list of contacts that match the contact_name argument
+    :param db: AsyncSession: Access the database
+    :param sort: str: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for, instead of using offset
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A list of rows of the contacts that match the contact_name argument
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter_by(name=contact_name, user_id=current_user.id).limit(limit).offset(offset).all()
-    return contacts
+    stmt = paginate(select(*contact_columns(fields, sort)).filter_by(name=contact_name, user_id=current_user.id), limit, offset, sort, cursor)
+    contacts = await db.execute(stmt)
+    return contacts.all()
 
 
-async def get_contact_by_surname(contact_surname: str, limit: int, offset: int, current_user: User, db: Session):
+async def get_contact_by_surname(contact_surname: str, limit: int, offset: int, current_user: User, db: AsyncSession, sort: str = "id", cursor: str | None = None,
+                                 fields: tuple[str, ...] | None = None):
     """
     The get_contact_by_surname function returns a list of contacts with the given surname.
 
@@ -68,32 +275,77 @@ async def get_contact_by_surname(contact_surname: str, limit: int, offset: int,
     :param limit: int: The maximum number of contacts to return.
     :param offset: int: The number of contacts to skip before returning results.
     :param current_user: User: The current user object.
-    :param db: Session: The database session object.
-    :return: A list containing all matching contacts, or an empty list if no matches are found.
+    :param db: AsyncSession: The database session object.
+    :param sort: str: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for, instead of using offset
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A list containing the rows of all matching contacts, or an empty list if no matches are found.
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter_by(surname=contact_surname, user_id=current_user.id)
-    contacts = contacts.limit(limit).offset(offset).all()
-    return contacts
+    stmt = paginate(select(*contact_columns(fields, sort)).filter_by(surname=contact_surname, user_id=current_user.id), limit, offset, sort, cursor)
+    contacts = await db.execute(stmt)
+    return contacts.all()
 
 
-async def get_contact_by_email(contact_email: str, current_user: User, db: Session):
+async def get_contact_by_email(contact_email: str, current_user: User, db: AsyncSession, fields: tuple[str, ...] | None = None):
     """
     The get_contact_by_email function returns a contact object from the database based on the email address provided.
     
     :param contact_email: str: Get the email of the contact
     :param current_user: User: Get the current user's id from the database
-    :param db: Session: Pass the database session to the function
-    :return: A contact object
+    :param db: AsyncSession: Pass the database session to the function
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A row with the selected columns, or None
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(email=contact_email, user_id=current_user.id).first()
-    return contact
+    stmt = select(*contact_columns(fields)).filter_by(email=contact_email, user_id=current_user.id)
+    contact = await db.execute(stmt)
+    return contact.first()
+
 
+async def search_contacts(query: str, limit: int, offset: int, current_user: User, db: AsyncSession, fields: tuple[str, ...] | None = None):
+    """
+    The search_contacts function finds contacts of the user by any of name, surname, email, phone and additional.
+    Every word of the query is matched as a prefix against the full-text vector, and the trigram
+    word similarity catches typos; both are served by GIN indexes over (user_id, ...).
+    Results are ordered by text rank plus similarity.
 
-async def get_birthdays_in_next_week(limit: int, offset: int, current_user: User, db: Session):
+    :param query: str: The search string
+    :param limit: int: Limit the number of results returned
+    :param offset: int: Skip the first n results
+    :param current_user: User: Only search the contacts of this user
+    :param db: AsyncSession: Access the database
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A list of rows, best matches first
+    :doc-author: Trelent
+    """
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return []
+    ts_query = func.to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{term}:*" for term in terms))
+    search_text = literal_column(f"({CONTACT_SEARCH_TEXT})")
+    rank = func.ts_rank(Contact.search_vector, ts_query) + func.word_similarity(query, search_text)
+    stmt = (
+        select(*contact_columns(fields))
+        .filter(
+            Contact.user_id == current_user.id,
+            or_(Contact.search_vector.op("@@")(ts_query), literal(query).op("<%")(search_text)),
+        )
+        .order_by(rank.desc(), Contact.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    contacts = await db.execute(stmt)
+    return contacts.all()
+
+
+async def get_birthdays_in_next_week(limit: int, offset: int, current_user: User, db: AsyncSession, sort: str = "id", cursor: str | None = None, days: int = 7,
+                                     fields: tuple[str, ...] | None = None):
     """
     The get_birthdays_in_next_week function returns a list of contacts with birthdays in the next week.
+    The window is a range over the indexed (user_id, birthday_doy) pair and wraps around the year end.
+    Results are cached per user until local midnight under the version of the user's contacts,
+    so contact writes invalidate them; without Redis nothing is cached.
 
         The function takes three arguments: limit, offset, and current_user.
         Limit is an integer that limits the number of results returned by the query.
@@ -103,41 +355,130 @@ async def get_birthdays_in_next_week(limit: int, offset: int, current_user: User
     :param limit: int: Limit the number of results returned
     :param offset: int: Specify the offset of the first record to return
     :param current_user: User: Filter the contacts by user_id
-    :param db: Session: Pass the database session to the function
-    :return: A list of contacts that have birthdays in the next week
+    :param db: AsyncSession: Pass the database session to the function
+    :param sort: str: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for, instead of using offset
+    :param days: int: The length of the window after today
+    :param fields: tuple[str, ...] | None: Select only these columns, see contact_columns
+    :return: A list of rows of the contacts that have birthdays in the next week
     :doc-author: Trelent
     """
     current_date = date.today()
-    next_week_start = current_date
-    next_week_end = current_date + timedelta(days=7)
+    # the version is read before the query: a page read before a write is stored under the old version and never served
+    version = await contact_versions.get(current_user.id)
+    cache_key = f"{version}:{current_date}:{days}:{limit}:{offset}:{ContactSort(sort).value}:{cursor}:{','.join(fields) if fields else '*'}"
+    if version is not None:
+        contacts = await birthday_cache.get(current_user.id, cache_key)
+        if contacts is not None:
+            return contacts
 
-    condition = between(extract('month', Contact.birthday), next_week_start.month, next_week_end.month) & \
-                between(extract('day', Contact.birthday), next_week_start.day, next_week_end.day)
+    if days >= 365:
+        condition = Contact.birthday_doy.is_not(None)
+    else:
+        window_start = day_of_year(current_date)
+        window_end = day_of_year(current_date + timedelta(days=days))
+        if window_start <= window_end:
+            condition = Contact.birthday_doy.between(window_start, window_end)
+        else:
+            condition = or_(Contact.birthday_doy >= window_start, Contact.birthday_doy <= window_end)
 
-    contacts = db.query(Contact).filter(condition).limit(limit).offset(offset).all()
+    stmt = paginate(select(*contact_columns(fields, sort)).filter(Contact.user_id == current_user.id, condition), limit, offset, sort, cursor)
+    contacts = await db.execute(stmt)
+    contacts = contacts.all()
 
+    if version is not None:
+        midnight = datetime.combine(current_date + timedelta(days=1), time.min)
+        await birthday_cache.set(current_user.id, cache_key, contacts, midnight)
     return contacts
 
 
-async def create_contact(body: ContactModel, current_user: User, db: Session):
+EXPORT_COLUMNS = (
+    Contact.id, Contact.name, Contact.surname, Contact.email, Contact.phone,
+    Contact.birthday, Contact.additional, Contact.created_at, Contact.updated_at,
+)
+
+
+async def stream_contacts(current_user: User, db: AsyncSession, batch_size: int = 1000):
+    """
+    The stream_contacts function reads every contact of the user through a server-side cursor.
+    Only the exported columns are selected and rows are fetched batch_size at a time,
+    so memory use does not depend on the size of the contact book.
+
+    :param current_user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: The number of rows fetched per round trip
+    :return: An async iterator of row lists
+    :doc-author: Trelent
+    """
+    stmt = select(*EXPORT_COLUMNS).filter_by(user_id=current_user.id).order_by(Contact.id)
+    result = await db.stream(stmt.execution_options(yield_per=batch_size))
+    try:
+        async for rows in result.partitions():
+            yield rows
+    finally:
+        await result.close()
+
+
+async def contacts_changed(user: User) -> None:
+    """
+    The contacts_changed function is called after every committed write to the contacts of a user:
+    it drops the cached birthday pages, bumps the version the ETags are derived from
+    and keeps the user's reads on the primary until the replicas have the write.
+
+    :param user: User: The owner of the changed contacts
+    :return: None
+    :doc-author: Trelent
+    """
+    await birthday_cache.invalidate(user.id)
+    await contact_versions.bump(user.id)
+    await read_your_writes.mark(user.email)
+
+
+async def create_contact(body: ContactModel, current_user: User, db: AsyncSession):
     """
     The create_contact function creates a new contact in the database.
+    It is a single INSERT ... RETURNING, so the response needs no second query.
         
     
     :param body: ContactModel: Pass in the contactmodel object that is created from the request body
     :param current_user: User: Get the user id of the current user
-    :param db: Session: Access the database
-    :return: A contact object
+    :param db: AsyncSession: Access the database
+    :return: A row with the columns of ResponseContact
     :doc-author: Trelent
     """
-    contact = Contact(**body.model_dump())
-    db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    stmt = insert(Contact).values(**body.model_dump(), user_id=current_user.id).returning(*CONTACT_COLUMNS)
+    contact = await db.execute(stmt)
+    contact = contact.first()
+    await db.execute(count_contacts(current_user.id, 1))
+    await db.commit()
+    await contacts_changed(current_user)
     return contact
 
 
-async def update_contact(body: ContactModel, contact_id: int, current_user: User, db: Session):
+async def create_contacts(bodies: list[ContactModel], current_user: User, db: AsyncSession) -> set[str]:
+    """
+    The create_contacts function inserts a batch of contacts with one multi-row INSERT and commits it.
+    Rows whose email already exists are skipped (ON CONFLICT DO NOTHING) instead of failing the batch.
+
+    :param bodies: list[ContactModel]: The validated contacts
+    :param current_user: User: The owner of the new contacts
+    :param db: AsyncSession: Access the database
+    :return: The emails of the contacts that were inserted
+    :doc-author: Trelent
+    """
+    if not bodies:
+        return set()
+    stmt = insert(Contact).on_conflict_do_nothing(index_elements=[Contact.email]).returning(Contact.email)
+    result = await db.execute(stmt, [dict(body.model_dump(), user_id=current_user.id) for body in bodies])
+    inserted = set(result.scalars().all())
+    if inserted:
+        await db.execute(count_contacts(current_user.id, len(inserted)))
+    await db.commit()
+    await contacts_changed(current_user)
+    return inserted
+
+
+async def update_contact(body: ContactModel, contact_id: int, current_user: User, db: AsyncSession):
     """
     The update_contact function updates a contact in the database.
 
@@ -145,47 +486,212 @@ async def update_contact(body: ContactModel, contact_id: int, current_user: User
             body (ContactModel): The updated contact information.
             contact_id (int): The id of the contact to update.
             current_user (User): The user who is making this request, used for authorization purposes.
-            db (Session): A connection to the database, used for querying and updating data.
+            db (AsyncSession): A connection to the database, used for querying and updating data.
     
     :param body: ContactModel: Receive the data from the request body
     :param contact_id: int: Identify the contact that is being updated
     :param current_user: User: Get the user_id from the current logged in user
-    :param db: Session: Access the database
-    :return: A contact
+    :param db: AsyncSession: Access the database
+    :return: A row with the columns of ResponseContact, or None if there is no such contact
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(id=contact_id, user_id=current_user.id).first()
+    stmt = (
+        update(Contact)
+        .where(Contact.id == contact_id, Contact.user_id == current_user.id)
+        .values(**body.model_dump())
+        .returning(*CONTACT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    contact = await db.execute(stmt)
+    contact = contact.first()
     if contact:
-        contact.name = body.name
-        contact.surname = body.surname
-        contact.email = body.email
-        contact.phone = body.phone
-        contact.birthday = body.birthday
-        contact.additional = body.additional
-        db.commit()
+        await db.commit()
+        await contacts_changed(current_user)
     return contact
 
 
-async def remove_contact(contact_id: int, current_user: User, db: Session):
+async def patch_contact(body: ContactPatch, contact_id: int, current_user: User, db: AsyncSession):
+    """
+    The patch_contact function changes only the fields sent in body.
+    The UPDATE sets just those columns and matches the row only if one of them differs,
+    so an unchanged contact is not written and its updated_at stays as it was.
+
+    :param body: ContactPatch: The fields to change, unset fields are left alone (null is rejected by ContactPatch)
+    :param contact_id: int: Identify the contact that is being updated
+    :param current_user: User: The owner of the contact
+    :param db: AsyncSession: Access the database
+    :return: A row with the columns of ResponseContact, or None if there is no such contact
+    :doc-author: Trelent
+    """
+    changes = body.model_dump(exclude_unset=True)
+    if changes:
+        stmt = (
+            update(Contact)
+            .where(
+                Contact.id == contact_id,
+                Contact.user_id == current_user.id,
+                or_(*(getattr(Contact, field).is_distinct_from(value) for field, value in changes.items())),
+            )
+            .values(**changes)
+            .returning(*CONTACT_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+        contact = await db.execute(stmt)
+        contact = contact.first()
+        if contact:
+            await db.commit()
+            await contacts_changed(current_user)
+            return contact
+    # nothing to change: the contact as it is, or None if it does not exist
+    stmt = select(*CONTACT_COLUMNS).where(Contact.id == contact_id, Contact.user_id == current_user.id)
+    contact = await db.execute(stmt)
+    return contact.first()
+
+
+async def remove_contact(contact_id: int, current_user: User, db: AsyncSession):
     """
     The remove_contact function removes a contact from the database.
     
         Args:
             contact_id (int): The id of the contact to be removed.
             current_user (User): The user who is making this request.
-            db (Session): A session object for interacting with the database.
+            db (AsyncSession): A session object for interacting with the database.
         Returns:
-            Contact: The deleted Contact object, or None if no such Contact exists.
+            Row: The columns of the deleted contact, or None if no such Contact exists.
     
     :param contact_id: int: Specify the id of the contact to be deleted
     :param current_user: User: Identify the user that is currently logged in
-    :param db: Session: Access the database
-    :return: The contact that was deleted
+    :param db: AsyncSession: Access the database
+    :return: A row with the columns of the deleted contact, or None if there is no such contact
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter_by(id=contact_id, user_id=current_user.id).first()
+    stmt = (
+        delete(Contact)
+        .where(Contact.id == contact_id, Contact.user_id == current_user.id)
+        .returning(*CONTACT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    contact = await db.execute(stmt)
+    contact = contact.first()
     if contact:
-        db.delete(contact)
-        db.commit()
+        await db.execute(count_contacts(current_user.id, -1))
+        await db.commit()
+        await contacts_changed(current_user)
     return contact
 
+
+
+PATCH_FIELDS = ("name", "surname", "email", "phone", "birthday", "additional")
+
+
+async def get_contacts_batch(ids: list[int], emails: list[str], current_user: User, db: AsyncSession) -> list[Contact]:
+    """
+    The get_contacts_batch function loads the user's contacts with any of the ids or emails in one query.
+
+    :param ids: list[int]: The ids to look up
+    :param emails: list[str]: The emails to look up
+    :param current_user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: The contacts found, ordered by id
+    :doc-author: Trelent
+    """
+    conditions = []
+    if ids:
+        conditions.append(Contact.id.in_(ids))
+    if emails:
+        conditions.append(Contact.email.in_(emails))
+    if not conditions:
+        return []
+    stmt = select(Contact).where(Contact.user_id == current_user.id, or_(*conditions)).order_by(Contact.id)
+    contacts = await db.execute(stmt)
+    return contacts.scalars().all()
+
+
+async def update_contacts_batch(items: list, current_user: User, db: AsyncSession) -> list[dict]:
+    """
+    The update_contacts_batch function applies a partial update to many contacts of the user with one UPDATE:
+    every column is set with CASE id WHEN ... THEN ... ELSE column END, only the fields sent for an item change.
+    Only the rows with a sent field that differs are written, the others keep their updated_at and are reported unchanged.
+    Items whose new email belongs to another contact are reported as conflict and left out.
+
+    :param items: list[ContactBatchUpdateItem]: The changes, one per contact id
+    :param current_user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A list of dicts with id, status and the updated contact, in the order of items
+    :doc-author: Trelent
+    """
+    results = {item.id: {"id": item.id, "status": "not_found", "contact": None} for item in items}
+    emails = {}
+    conflicts = set()
+    for item in items:
+        if item.email is not None:
+            if item.email in emails:
+                conflicts.add(item.id)
+            else:
+                emails[item.email] = item.id
+    if emails:
+        stmt = select(Contact.id, Contact.email).where(Contact.email.in_(list(emails)))
+        owners = await db.execute(stmt)
+        conflicts.update(emails[email] for contact_id, email in owners.all() if emails[email] != contact_id)
+    for contact_id in conflicts:
+        results[contact_id]["status"] = "conflict"
+    items = [item for item in items if item.id not in conflicts]
+    if not items:
+        return list(results.values())
+
+    changes = {item.id: item.model_dump(exclude_unset=True, exclude={"id"}) for item in items}
+    changes = {contact_id: fields for contact_id, fields in changes.items() if fields}
+    updated = []
+    if changes:
+        values = {}
+        for field in PATCH_FIELDS:
+            whens = {contact_id: fields[field] for contact_id, fields in changes.items() if field in fields}
+            if whens:
+                values[field] = case(whens, value=Contact.id, else_=getattr(Contact, field))
+        # a row is written only if one of its sent fields differs, as in patch_contact
+        differs = [
+            and_(Contact.id == contact_id, or_(*(getattr(Contact, field).is_distinct_from(value) for field, value in fields.items())))
+            for contact_id, fields in changes.items()
+        ]
+        stmt = (
+            update(Contact)
+            .where(Contact.id.in_(list(changes)), Contact.user_id == current_user.id, or_(*differs))
+            .values(**values)
+            .returning(Contact)
+            .execution_options(synchronize_session=False)
+        )
+        updated = await db.execute(stmt)
+        updated = updated.scalars().all()
+        for contact in updated:
+            results[contact.id].update(status="updated", contact=contact)
+    # the rest either sent nothing new or does not exist
+    rest = [item.id for item in items if results[item.id]["status"] == "not_found"]
+    if rest:
+        stmt = select(Contact).where(Contact.id.in_(rest), Contact.user_id == current_user.id)
+        contacts = await db.execute(stmt)
+        for contact in contacts.scalars().all():
+            results[contact.id].update(status="unchanged", contact=contact)
+    if updated:
+        await db.commit()
+        await contacts_changed(current_user)
+    return list(results.values())
+
+
+async def remove_contacts_batch(ids: list[int], current_user: User, db: AsyncSession) -> list[dict]:
+    """
+    The remove_contacts_batch function deletes many contacts of the user with one DELETE ... RETURNING.
+
+    :param ids: list[int]: The ids of the contacts to delete
+    :param current_user: User: The owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A list of dicts with id and status (deleted or not_found), in the order of ids
+    :doc-author: Trelent
+    """
+    stmt = delete(Contact).where(Contact.id.in_(ids), Contact.user_id == current_user.id).returning(Contact.id)
+    deleted = await db.execute(stmt)
+    deleted = set(deleted.scalars().all())
+    if deleted:
+        await db.execute(count_contacts(current_user.id, -len(deleted)))
+        await db.commit()
+        await contacts_changed(current_user)
+    return [{"id": contact_id, "status": "deleted" if contact_id in deleted else "not_found"} for contact_id in dict.fromkeys(ids)]
@@ -1,31 +1,40 @@
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas import UserModel
+from src.services.cache import read_your_writes, user_cache
 
+# the columns UserDb is built from, returned by the writes so no reload is needed
+USER_COLUMNS = (User.id, User.username, User.email, User.created_at.label("created_at"), User.avatar)
 
-async def get_user_by_email(email: str, db: Session) -> User:
+
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user with that email if it exists. If no such user exists,
     it returns None.
 
     :param email: str: Pass in the email of the user to be retrieved from the database
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: The first user with the given email
     :doc-author: Trelent
     """
-    return db.query(User).filter(User.email == email).first()
+    stmt = select(User).filter(User.email == email)
+    user = await db.execute(stmt)
+    return user.scalars().first()
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
     
+    It is a single INSERT ... RETURNING, the result is a row with the columns of UserDb.
+    
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Create a database session
-    :return: A user
+    :param db: AsyncSession: Create a database session
+    :return: A user row
     :doc-author: Trelent
     """
     avatar = None
@@ -34,53 +43,82 @@ async def create_user(body: UserModel, db: Session) -> User:
         avatar = g.get_image()
     except Exception as e:
         print(e)
-    new_user = User(**body.model_dump(), avatar=avatar)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    stmt = insert(User).values(**body.model_dump(), avatar=avatar).returning(*USER_COLUMNS)
+    new_user = await db.execute(stmt)
+    new_user = new_user.first()
+    await db.commit()
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_token(user: User, token: str | None, db: AsyncSession) -> None:
     """
     The update_token function updates the refresh token for a user.
     
     :param user: User: Identify the user in the database
     :param token: str | None: Update the refresh_token field in the user table
-    :param db: Session: Commit the changes to the database
+    :param db: AsyncSession: Commit the changes to the database
     :return: None
     :doc-author: Trelent
     """
-    user.refresh_token = token
-    db.commit()
+    stmt = update(User).where(User.id == user.id).values(refresh_token=token)
+    await db.execute(stmt)
+    await db.commit()
+    await user_cache.invalidate(user.email)
+    await read_your_writes.mark(user.email)
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def update_password(user: User, password: str, db: AsyncSession) -> None:
     """
-    The confirmed_email function sets the confirmed field of a user to True.
+    The update_password function replaces the stored password hash of a user.
     
-    :param email: str: Get the email of the user
-    :param db: Session: Pass the database session to the function
+    :param user: User: Identify the user in the database
+    :param password: str: The new password hash
+    :param db: AsyncSession: Commit the changes to the database
     :return: None
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
-    db.commit()
+    stmt = update(User).where(User.id == user.id).values(password=password)
+    await db.execute(stmt)
+    await db.commit()
+    await user_cache.invalidate(user.email)
+    await read_your_writes.mark(user.email)
+
+
+async def confirmed_email(email: str, db: AsyncSession) -> bool:
+    """
+    The confirmed_email function sets the confirmed field of a user to True,
+    with one UPDATE that only matches a user who is not confirmed yet.
+    
+    :param email: str: Get the email of the user
+    :param db: AsyncSession: Pass the database session to the function
+    :return: True if the user was confirmed now, False if there is no such user or it was confirmed before
+    :doc-author: Trelent
+    """
+    stmt = update(User).where(User.email == email, User.confirmed.is_not(True)).values(confirmed=True).returning(User.id)
+    confirmed = await db.execute(stmt)
+    confirmed = confirmed.first() is not None
+    if confirmed:
+        await db.commit()
+        await user_cache.invalidate(email)
+        await read_your_writes.mark(email)
+    return confirmed
 
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession) -> User:
     """
     The update_avatar function updates the avatar of a user.
         
     
     :param email: str: The email address of the user to update
     :param url: str: The URL for the new avatar image
-    :param db: Session: Pass the database session to the function
-    :return: The user object
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A row with the columns of UserDb, None if there is no such user
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.avatar = url
-    db.commit()
+    stmt = update(User).where(User.email == email).values(avatar=url).returning(*USER_COLUMNS)
+    user = await db.execute(stmt)
+    user = user.first()
+    await db.commit()
+    await user_cache.invalidate(email)
+    await read_your_writes.mark(email)
     return user
@@ -2,7 +2,7 @@ from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 from src.database.db import get_db
@@ -10,40 +10,45 @@ from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.repository import users as repository_users
 from src.services.auth import auth_service
 from src.services.email import send_email
+from src.services.rate_limit import RateLimiter
+from src.conf.config import settings
 
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+# login and signup hash a password with bcrypt, they cost more of the budget
+router = APIRouter(prefix="/auth", tags=["auth"], dependencies=[Depends(RateLimiter(
+    "auth", settings.rate_limit_auth, settings.rate_limit_window, costs={"login": 5, "signup": 5},
+))])
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
     
     :param body: UserModel: Get the data from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dict with the user and a detail string
     :doc-author: Trelent
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
     background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
     return {"user": new_user, "detail": "User successfully created. Check your email for confirmation."}
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
     
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
-    :param db: Session: Pass the database connection to the function
+    :param db: AsyncSession: Pass the database connection to the function
     :return: A dictionary with the access_token, refresh_token and token type
     :doc-author: Trelent
     """
@@ -52,8 +57,12 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.verify_and_update_password(body.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash:
+        # the work factor changed since the hash was made
+        await repository_users.update_password(user, new_hash, db)
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email})
     refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
@@ -62,7 +71,7 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
 
 
 @router.get("/refresh_token", response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db),):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: AsyncSession = Depends(get_db),):
     """
     The refresh_token function is used to refresh the access token.
 
@@ -70,7 +79,7 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(sec
     a new refresh_token, and the type of token (bearer).
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header.
-    :param db: Session: Get the database session.
+    :param db: AsyncSession: Get the database session.
     :return: A dict with the following keys: access_token, refresh_token, and token type.
     :doc-author: Trelent
     """
@@ -94,7 +103,7 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(sec
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
 
@@ -106,23 +115,22 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     Otherwise, we call our repository_users function confirmed_email() which
     
     :param token: str: Get the token from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with a "message" key and "Email confirmed" value
     :doc-author: Trelent
     """
     email = await auth_service.get_email_from_token(token)
+    if await repository_users.confirmed_email(email, db):
+        return {"message": "Email confirmed"}
     user = await repository_users.get_user_by_email(email, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Verification error")
-    if user.confirmed:
-        return {"message": "Your email is already confirmed"}
-    await repository_users.confirmed_email(email, db)
-    return {"message": "Email confirmed"}
+    return {"message": "Your email is already confirmed"}
 
 
 
 @router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link
     to confirm their account. 
@@ -137,7 +145,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     :param body: RequestEmail: Deserialize the request body into a requestemail object
     :param background_tasks: BackgroundTasks: Add tasks to the background
     :param request: Request: Get the base url of the server
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A dict with a "message" key and "Check your email for confirmation." value
     :doc-author: Trelent
     """
@@ -1,42 +1,187 @@
+import hashlib
 from datetime import datetime, timedelta
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query, Response, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.schemas import ResponseContact, ContactModel
+from src.database.db import get_db, get_read_db, read_session
+from src.schemas import ResponseContact, ContactModel, ContactSort, ContactField, ContactPage, ImportFormat, ImportReport, ExportFormat, \
+    ContactPatch, ContactBatchGet, ContactBatchGetResponse, ContactBatchUpdate, ContactBatchIds, ContactBatchResult
 from src.repository import contacts as repository_contacts
 from src.services.auth import auth_service
+from src.services.cache import contact_versions
+from src.services.rate_limit import RateLimiter
+from src.services import contacts_import, contacts_export
+from src.conf.config import settings
 from src.database.models import User
 
-router = APIRouter(prefix='/contacts', tags=['contacts'])
+router = APIRouter(prefix='/contacts', tags=['contacts'], dependencies=[Depends(RateLimiter(
+    "contacts", settings.rate_limit_contacts, settings.rate_limit_window, costs={
+        "import_contacts": 10, "export_contacts": 10,
+        "batch_get_contacts": 5, "batch_update_contacts": 5, "batch_remove_contacts": 5,
+    },
+))])
 
 
+def set_next_cursor(response: Response, contacts: list, limit: int, sort: ContactSort):
+    """
+    The set_next_cursor function puts the cursor of the following page into the X-Next-Cursor header.
+    The header is omitted on the last page.
+
+    :param response: Response: The response the header is set on
+    :param contacts: list: The contacts of the current page
+    :param limit: int: The requested page size
+    :param sort: ContactSort: The sort order of the page
+    :return: None
+    :doc-author: Trelent
+    """
+    cursor = repository_contacts.next_cursor(contacts, limit, sort)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+
+invalid_cursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+# clients may keep the answer but have to revalidate it, a revalidation costs no database rows
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """
+    The make_etag function builds a strong ETag from everything the response depends on.
+
+    :param parts: The values that identify the response
+    :return: A quoted ETag
+    :doc-author: Trelent
+    """
+    return '"' + hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()[:32] + '"'
+
+
+def contact_fields(fields: str | None = Query(None, description="Comma separated fields to return, e.g. name,surname,phone. id is always returned")) -> tuple[str, ...] | None:
+    """
+    The contact_fields function parses the sparse fieldset of the contact read routes.
+
+    :param fields: str | None: The fields query parameter
+    :return: The field names in the order given, or None for all fields
+    :doc-author: Trelent
+    """
+    if not fields:
+        return None
+    try:
+        names = [ContactField(name.strip()).value for name in fields.split(",") if name.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown field, fields may be {', '.join(field.value for field in ContactField)}")
+    return tuple(dict.fromkeys(names)) or None
+
+
+def fast_json(response: Response, content, fields: tuple[str, ...] | None = None, page: dict | None = None) -> ORJSONResponse:
+    """
+    The fast_json function encodes rows selected with contact_columns straight with orjson.
+    The rows have exactly the fields of ResponseContact, so validating every item again would change nothing.
+    With a sparse fieldset only id and the requested fields are sent, the extra sort key column is left out.
+    The headers already set on response (ETag, X-Next-Cursor, rate limit) are carried over.
+
+    :param response: Response: The response the dependencies and the route set headers on
+    :param content: A list of rows, or a single row
+    :param fields: tuple[str, ...] | None: The fields to send, None for all of them
+    :param page: dict | None: The page metadata, when given the rows are sent as items of a ContactPage
+    :return: The JSON response
+    :doc-author: Trelent
+    """
+    names = None if fields is None else tuple(dict.fromkeys(("id", *fields)))
 
-@router.get("/", response_model=List[ResponseContact], name="Get all contacts form database (10 requests per minute)", dependencies=[Depends(RateLimiter(times=10, seconds=60))],)
-async def get_contacts(limit: int = Query(10, le=1000), offset: int = 0, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+    def as_dict(row) -> dict:
+        if names is None:
+            return row._asdict()
+        return {name: row._mapping[name] for name in names}
+
+    content = [as_dict(row) for row in content] if isinstance(content, list) else as_dict(content)
+    if page is not None:
+        content = {"items": content, **page}
+    return ORJSONResponse(content, headers=dict(response.headers))
+
+
+def not_modified(request: Request, response: Response, etag: str | None) -> Response | None:
+    """
+    The not_modified function sets the validators on the response and
+    returns a 304 Not Modified response if the client already has this representation (If-None-Match).
+    The 304 carries every header already set on response, the validators among them.
+
+    :param request: Request: Read the If-None-Match header
+    :param response: Response: The response the ETag and Cache-Control headers are set on
+    :param etag: str | None: The current ETag, None if it could not be computed
+    :return: The 304 response, or None if the full response has to be sent
+    :doc-author: Trelent
+    """
+    if etag is None:
+        return None
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in tags or "*" in tags:
+        # the headers the dependencies set (X-RateLimit-*) go out with the 304 too, repeated ones included
+        cached = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+        cached.raw_headers.extend(response.raw_headers)
+        return cached
+    return None
+
+
+@router.get("/", response_model=List[ResponseContact] | ContactPage, name="Get all contacts form database",)
+async def get_contacts(request: Request, response: Response, limit: int = Query(10, le=1000), offset: int = 0, sort: ContactSort = ContactSort.id, cursor: str | None = None, fields: tuple[str, ...] | None = Depends(contact_fields), envelope: bool = False, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contacts function returns a list of contacts.
 
     The limit and offset parameters are used to paginate the results.
+    Pass the X-Next-Cursor header of a page as cursor to get the next one at a constant cost.
+    The ETag follows the version of the user's contacts, so a matching If-None-Match is answered
+    with 304 Not Modified without touching the database. The version is bumped after the write commits
+    on the primary, so the page is read from the primary too: a lagging replica could otherwise
+    store an old page under the new ETag.
+    The page is read as plain rows and encoded with orjson, see fast_json.
+    fields=name,phone selects and returns only id and those columns.
+    envelope=true wraps the page in a ContactPage with the total number of the user's contacts,
+    read from the counter the writes keep, never counted.
         
     
+    :param request: Request: Read the If-None-Match header
+    :param response: Response: Set the X-Next-Cursor and ETag headers
     :param limit: int: Limit the amount of contacts returned
     :param le: Limit the maximum number of contacts that can be returned
     :param offset: int: Specify the offset of the first item to be returned
-    :param db: Session: Get a database session
+    :param sort: ContactSort: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param envelope: bool: Return a ContactPage instead of a bare list
+    :param db: AsyncSession: Get a database session
     :param current_user: User: Get the current user from the database
-    :return: A list of contacts
+    :return: A list of contacts, or a ContactPage
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_all_contacts(limit, offset, current_user, db)
-    return contacts
+    version = await contact_versions.get(current_user.id)
+    etag = make_etag(current_user.id, version, limit, offset, sort.value, cursor, fields, envelope) if version else None
+    cached = not_modified(request, response, etag)
+    if cached is not None:
+        return cached
+    try:
+        contacts = await repository_contacts.get_all_contacts(limit, offset, current_user, db, sort, cursor, fields)
+    except ValueError:
+        raise invalid_cursor
+    set_next_cursor(response, contacts, limit, sort)
+    if not envelope:
+        return fast_json(response, contacts, fields)
+    total = await repository_contacts.get_contacts_total(current_user, db)
+    page = {"total": total, "limit": limit, "offset": offset, "next_cursor": response.headers.get("X-Next-Cursor")}
+    return fast_json(response, contacts, fields, page)
 
 
 @router.post("/", response_model=ResponseContact, status_code=status.HTTP_201_CREATED, name="Create a new contact",)
-async def create_contact(body: ContactModel, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def create_contact(body: ContactModel, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The create_contact function creates a new contact in the database.
 
@@ -46,7 +191,7 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db), curr
     email: EmailStr = Field(..., title=&quot;The email address of the contact&quot;)
     
     :param body: ContactModel: Get the data from the request body
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the user id of the current user
     :return: A contactmodel object
     :doc-author: Trelent
@@ -55,25 +200,95 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db), curr
     return contact
 
 
+@router.post("/import", response_model=ImportReport, name="Import contacts from CSV, NDJSON or vCard",)
+async def import_contacts(request: Request, format: ImportFormat | None = None, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The import_contacts function imports a whole address book sent as the raw request body.
+
+    The body is streamed and parsed as it arrives; the format comes from the format parameter
+    or from the Content-Type header (text/csv, application/x-ndjson, text/vcard).
+    CSV files need a header row with the ContactModel field names.
+    
+    :param request: Request: Stream the request body
+    :param format: ImportFormat | None: The format of the body, overrides the Content-Type
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the owner of the imported contacts
+    :return: An import report with per-row errors and the throughput
+    :doc-author: Trelent
+    """
+    import_format = format or contacts_import.detect_format(request.headers.get("content-type"))
+    if import_format is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unknown import format",)
+    try:
+        report = await contacts_import.import_contacts(request.stream(), import_format, current_user, db)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload is not valid UTF-8",)
+    return report
+
+
+@router.get("/export", response_class=StreamingResponse, name="Export all contacts as CSV or NDJSON",)
+async def export_contacts(request: Request, format: ExportFormat = ExportFormat.ndjson, current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The export_contacts function streams the whole contact book of the user.
+
+    Rows come from a server-side cursor in batches of settings.export_batch_size
+    and are written to the client as they are read, so memory stays constant.
+    The session is opened and closed by the body itself, not by a dependency:
+    the body is sent after the route returns, when the dependencies may already be torn down.
+    
+    :param request: Request: Route the read to a replica or the primary, see read_session
+    :param format: ExportFormat: csv or ndjson
+    :param current_user: User: Get the owner of the contacts
+    :return: A streaming response
+    :doc-author: Trelent
+    """
+    async def rows():
+        async with read_session(request, shared=False) as db:
+            async for batch in repository_contacts.stream_contacts(current_user, db, settings.export_batch_size):
+                yield batch
+
+    return StreamingResponse(
+        contacts_export.export_contacts(rows(), format.value),
+        media_type=contacts_export.MEDIA_TYPES[format.value],
+        headers={"Content-Disposition": f'attachment; filename="contacts.{format.value}"'},
+    )
+
+
 @router.get("/id/{contact_id}", response_model=ResponseContact, name="Find contact by ID")
-async def get_contact_by_id(contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def get_contact_by_id(request: Request, response: Response, contact_id: int = Path(ge=1), fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contact_by_id function returns a contact by its ID.
+    The ETag follows updated_at of the contact. A request with If-None-Match first reads that single column
+    and a match is answered with 304 Not Modified; without it the row is read once and the ETag built from it.
     
+    :param request: Request: Read the If-None-Match header
+    :param response: Response: Set the ETag header
     :param contact_id: int: Get the id of the contact that you want to retrieve
-    :param db: Session: Pass the database session to the repository layer
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact_by_id(contact_id, current_user, db)
+    not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with ID={contact_id} not found",)
+    if request.headers.get("if-none-match"):
+        updated_at = await repository_contacts.get_contact_updated_at(contact_id, current_user, db)
+        if updated_at is None:
+            raise not_found
+        cached = not_modified(request, response, make_etag(contact_id, updated_at.isoformat(), fields))
+        if cached is not None:
+            return cached
+    contact = await repository_contacts.get_contact_by_id(contact_id, current_user, db, fields, with_updated_at=True)
     if contact is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with ID={contact_id} not found",)
-    return contact
+        raise not_found
+    cached = not_modified(request, response, make_etag(contact_id, contact.updated_at.isoformat(), fields))
+    if cached is not None:
+        return cached
+    return fast_json(response, contact, fields)
 
 
 @router.get("/name/{contact_name}", response_model=list[ResponseContact], name="Find contact by name",)
-async def get_contact_by_name(contact_name: str, limit: int = Query(10, le=1000), offset: int = 0, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def get_contact_by_name(contact_name: str, response: Response, limit: int = Query(10, le=1000), offset: int = 0, sort: ContactSort = ContactSort.id, cursor: str | None = None, fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contact_by_name function is used to search for a contact by name.
 
@@ -84,22 +299,30 @@ async def get_contact_by_name(contact_name: str, limit: int = Query(10, le=1000)
     The function returns a list of Contact objects that match your query.
     
     :param contact_name: str: Pass the name of the contact to be searched
+    :param response: Response: Set the X-Next-Cursor header
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the number of results returned
     :param offset: int: Skip the first n records
-    :param db: Session: Get the database session object
+    :param sort: ContactSort: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Get the database session object
     :param current_user: User: Get the user_id of the current logged in user
     :return: The function returns a list of Contact objects that match your query
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contact_by_name(contact_name, limit, offset, current_user, db)
+    try:
+        contacts = await repository_contacts.get_contact_by_name(contact_name, limit, offset, current_user, db, sort, cursor, fields)
+    except ValueError:
+        raise invalid_cursor
+    set_next_cursor(response, contacts, limit, sort)
     if contacts is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contacts with name {contact_name} not found",)
-    return contacts
+    return fast_json(response, contacts, fields)
 
 
 @router.get("/surname/{contact_surname}", response_model=list[ResponseContact], name="Find contact by surname",)
-async def get_contact_by_surname(contact_surname: str, limit: int = Query(10, le=1000), offset: int = 0, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def get_contact_by_surname(contact_surname: str, response: Response, limit: int = Query(10, le=1000), offset: int = 0, sort: ContactSort = ContactSort.id, cursor: str | None = None, fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contact_by_surname function is used to retrieve a list of contacts with the same surname.
 
@@ -107,22 +330,30 @@ async def get_contact_by_surname(contact_surname: str, limit: int = Query(10, le
     It returns an HTTP response containing the list of contacts with that surname.
     
     :param contact_surname: str: Get the surname of a contact
+    :param response: Response: Set the X-Next-Cursor header
     :param limit: int: Limit the number of results returned
     :param le: Limit the number of results returned
     :param offset: int: Specify the number of records to skip before starting to return rows
-    :param db: Session: Get the database session
+    :param sort: ContactSort: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contact_by_surname(contact_surname, limit, offset, db)
+    try:
+        contacts = await repository_contacts.get_contact_by_surname(contact_surname, limit, offset, current_user, db, sort, cursor, fields)
+    except ValueError:
+        raise invalid_cursor
+    set_next_cursor(response, contacts, limit, sort)
     if contacts is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contacts with surname {contact_surname} not found",)
-    return contacts
+    return fast_json(response, contacts, fields)
 
 
 @router.get("/email/{contact_email}", response_model=ResponseContact, name="Find contact by email",)
-async def get_contact_by_email(contact_email: str, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def get_contact_by_email(contact_email: str, response: Response, fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contact_by_email function is used to retrieve a contact by email.
 
@@ -130,41 +361,124 @@ async def get_contact_by_email(contact_email: str, db: Session = Depends(get_db)
     
     
     :param contact_email: str: Pass the email of the contact we want to retrieve
-    :param db: Session: Pass the database session to the repository layer
+    :param response: Response: Carries the headers set by the dependencies
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact_by_email(contact_email, db)
+    contact = await repository_contacts.get_contact_by_email(contact_email, current_user, db, fields)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with email {contact_email} not found",)
-    return contact
+    return fast_json(response, contact, fields)
+
+
+@router.get("/search", response_model=list[ResponseContact], name="Search contacts by any field",)
+async def search_contacts(response: Response, q: str = Query(min_length=1, max_length=100), limit: int = Query(10, le=1000), offset: int = 0, fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The search_contacts function searches the contacts of the user by name, surname, email, phone and additional.
+
+    Words are matched as prefixes and small typos are tolerated; the best matches come first.
+    
+    :param response: Response: Carries the headers set by the dependencies
+    :param q: str: The search string
+    :param limit: int: Limit the number of results returned
+    :param offset: int: Skip the first n results
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the database
+    :return: A list of contacts
+    :doc-author: Trelent
+    """
+    contacts = await repository_contacts.search_contacts(q, limit, offset, current_user, db, fields)
+    return fast_json(response, contacts, fields)
 
 
 @router.get("/birthdays_in_next_week", response_model=list[ResponseContact])
-async def get_birthdays_in_next_week(limit: int = Query(10, le=1000), offset: int = 0, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def get_birthdays_in_next_week(response: Response, days: int = Query(7, ge=1, le=365), limit: int = Query(10, le=1000), offset: int = 0, sort: ContactSort = ContactSort.id, cursor: str | None = None, fields: tuple[str, ...] | None = Depends(contact_fields), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The get_contacts_with_birthdays_in_next_7_days function returns a list of contacts with birthdays in the next 7 days.
 
     The limit and offset parameters are used to paginate the results.
+    The result is cached until midnight, so it is read from the primary: a lagging replica
+    would keep a change the cache was just invalidated for out of it for the rest of the day.
     
-    
+    :param response: Response: Set the X-Next-Cursor header
+    :param days: int: The length of the window after today, 7 by default
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the maximum number of contacts returned
     :param offset: int: Specify the number of records to skip before returning the results
-    :param db: Session: Pass the database session to the repository layer
+    :param sort: ContactSort: Order the contacts by id, name, surname, birthday or created_at
+    :param cursor: str | None: Continue after the page the cursor was issued for
+    :param fields: tuple[str, ...] | None: The sparse fieldset
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the auth_service
     :return: A list of contacts with birthdays in the next 7 days
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_birthdays_in_next_week(limit, offset, current_user, db)
+    try:
+        contacts = await repository_contacts.get_birthdays_in_next_week(limit, offset, current_user, db, sort, cursor, days, fields)
+    except ValueError:
+        raise invalid_cursor
+    set_next_cursor(response, contacts, limit, sort)
     if not contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contacts with birthdays for the next week not found",)
-    return contacts
+    return fast_json(response, contacts, fields)
+
+
+@router.post("/batch/get", response_model=ContactBatchGetResponse, name="Get many contacts by ids or emails",)
+async def batch_get_contacts(body: ContactBatchGet, db: AsyncSession = Depends(get_read_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The batch_get_contacts function returns the contacts with the given ids or emails in one query,
+    and reports the ones that were not found.
+
+    :param body: ContactBatchGet: The ids and emails to look up
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: The contacts found and the missing ids and emails
+    :doc-author: Trelent
+    """
+    contacts = await repository_contacts.get_contacts_batch(body.ids, body.emails, current_user, db)
+    found_ids = {contact.id for contact in contacts}
+    found_emails = {contact.email for contact in contacts}
+    return {
+        "contacts": contacts,
+        "missing_ids": [contact_id for contact_id in dict.fromkeys(body.ids) if contact_id not in found_ids],
+        "missing_emails": [email for email in dict.fromkeys(body.emails) if email not in found_emails],
+    }
+
+
+@router.patch("/batch", response_model=list[ContactBatchResult], name="Update many contacts",)
+async def batch_update_contacts(body: ContactBatchUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The batch_update_contacts function changes the fields sent for every item with a single UPDATE in one transaction.
+
+    :param body: ContactBatchUpdate: The changes, one item per contact id
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: The status of every item: updated, unchanged, not_found or conflict (email taken)
+    :doc-author: Trelent
+    """
+    return await repository_contacts.update_contacts_batch(body.items, current_user, db)
+
+
+@router.delete("/batch", response_model=list[ContactBatchResult], name="Delete many contacts",)
+async def batch_remove_contacts(body: ContactBatchIds, db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The batch_remove_contacts function deletes the contacts with a single DELETE in one transaction.
+
+    :param body: ContactBatchIds: The ids of the contacts to delete
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: The status of every id: deleted or not_found
+    :doc-author: Trelent
+    """
+    return await repository_contacts.remove_contacts_batch(body.ids, current_user, db)
 
 
 @router.put("/{contact_id}", response_model=ResponseContact)
-async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The update_contact function updates a contact in the database.
 
@@ -173,29 +487,47 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
     
     :param body: ContactModel: Pass the contact details to be updated
     :param contact_id: int: Specify the id of the contact to be updated
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the database
     :return: The contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.update_contact(body, contact_id, db)
-    if get_contact_by_id is None:
+    contact = await repository_contacts.update_contact(body, contact_id, current_user, db)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with ID {contact_id} not found",)
+    return contact
+
+
+@router.patch("/{contact_id}", response_model=ResponseContact)
+async def patch_contact(body: ContactPatch, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+    """
+    The patch_contact function updates only the fields sent in the body.
+    A body that changes nothing is not written and leaves updated_at as it was.
+
+    :param body: ContactPatch: The fields to change
+    :param contact_id: int: Specify the id of the contact to be updated
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user from the database
+    :return: The contact object
+    :doc-author: Trelent
+    """
+    contact = await repository_contacts.patch_contact(body, contact_id, current_user, db)
+    if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with ID {contact_id} not found",)
     return contact
 
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT, name="Delete contact form database by ID",)
-async def remove_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
+async def remove_contact(contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user),):
     """
     The remove_contact function removes a contact from the database.
     
     :param contact_id: int: Specify the id of the contact to be removed
-    :param db: Session: Pass the database connection to the function
+    :param db: AsyncSession: Pass the database connection to the function
     :param current_user: User: Get the current user
-    :return: A contact object
+    :return: None, the response has no body
     :doc-author: Trelent
     """
-    contact = await repository_contacts.remove_contact(contact_id, db)
+    contact = await repository_contacts.remove_contact(contact_id, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Contact with ID={contact_id} not found",)
-    return contact
@@ -1,16 +1,18 @@
-from fastapi import APIRouter, Depends, UploadFile, File
-from sqlalchemy.orm import Session
-import cloudinary
-import cloudinary.uploader
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.avatars import avatar_service, AvatarTooLarge, InvalidImage
+from src.services.rate_limit import RateLimiter
 from src.conf.config import settings
 from src.schemas import UserDb
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], dependencies=[Depends(RateLimiter(
+    "users", settings.rate_limit_users, settings.rate_limit_window, costs={"update_avatar_user": 5},
+))])
 
 
 @router.get("/me/", response_model=UserDb)
@@ -30,29 +32,26 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 async def update_avatar_user(
     file: UploadFile = File(),
     current_user: User = Depends(auth_service.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     The update_avatar_user function updates the avatar of a user.
+    The image is resized to 250x250 off the event loop and stored under its content hash;
+    uploading the current avatar again changes nothing.
 
     :param file: UploadFile: Get the file from the request
     :param current_user: User: Get the current user
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A user object
     :doc-author: Trelent
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True,
-    )
-
-    r = cloudinary.uploader.upload(
-        file.file, public_id=f"NotesApp/{current_user.username}", overwrite=True
-    )
-    src_url = cloudinary.CloudinaryImage(f"NotesApp/{current_user.username}").build_url(
-        width=250, height=250, crop="fill", version=r.get("version")
-    )
+    try:
+        src_url = await avatar_service.upload(file, current_user.avatar)
+    except AvatarTooLarge as err:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(err))
+    except InvalidImage:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is not a supported image")
+    if src_url is None:
+        return current_user
     user = await repository_users.update_avatar(current_user.email, src_url, db)
-    return user
\ No newline at end of file
+    return user
@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr, Field
+from enum import Enum
+
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime, date
 
 from pydantic_settings import SettingsConfigDict
@@ -14,6 +16,51 @@ class ContactModel(BaseModel):
     additional: str = Field()
     
 
+class ContactSort(str, Enum):
+    id = "id"
+    name = "name"
+    surname = "surname"
+    birthday = "birthday"
+    created_at = "created_at"
+
+
+class ContactField(str, Enum):
+    id = "id"
+    name = "name"
+    surname = "surname"
+    email = "email"
+    phone = "phone"
+    birthday = "birthday"
+    additional = "additional"
+    created_at = "created_at"
+    updated_at = "updated_at"
+
+
+class ImportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    vcard = "vcard"
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    total: int
+    imported: int
+    failed: int
+    errors: list[ImportRowError]
+    seconds: float
+    rows_per_second: float
+
+
 class ResponseContact(BaseModel):
     model_config = SettingsConfigDict(from_attributes=True)
     id: int = 1
@@ -28,6 +75,75 @@ class ResponseContact(BaseModel):
 
 
 
+class ContactPage(BaseModel):
+    items: list[ResponseContact]
+    total: int
+    limit: int
+    offset: int
+    next_cursor: str | None = None
+
+
+class ContactPatch(BaseModel):
+    name: str | None = Field(None, min_length=2, max_length=20)
+    surname: str | None = Field(None, min_length=2, max_length=20)
+    email: str | None = None
+    phone: str | None = Field(None, min_length=2, max_length=20)
+    birthday: date | None = None
+    additional: str | None = None
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def not_null(cls, value):
+        # every contact field is required, so a field can be left out but not cleared
+        if value is None:
+            raise ValueError("may not be null, leave the field out to keep its value")
+        return value
+
+
+class ContactBatchUpdateItem(ContactPatch):
+    id: int = Field(ge=1)
+
+
+class ContactBatchUpdate(BaseModel):
+    items: list[ContactBatchUpdateItem] = Field(min_length=1, max_length=500)
+
+    @field_validator("items")
+    @classmethod
+    def unique_ids(cls, items):
+        if len({item.id for item in items}) != len(items):
+            raise ValueError("every contact id may appear once")
+        return items
+
+
+class ContactBatchIds(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=500)
+
+
+class ContactBatchGet(BaseModel):
+    ids: list[int] = Field([], max_length=500)
+    emails: list[str] = Field([], max_length=500)
+
+
+class ContactBatchGetResponse(BaseModel):
+    contacts: list[ResponseContact]
+    missing_ids: list[int]
+    missing_emails: list[str]
+
+
+class BatchItemStatus(str, Enum):
+    updated = "updated"
+    unchanged = "unchanged"
+    deleted = "deleted"
+    not_found = "not_found"
+    conflict = "conflict"
+
+
+class ContactBatchResult(BaseModel):
+    id: int
+    status: BatchItemStatus
+    contact: ResponseContact | None = None
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
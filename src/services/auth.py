@@ -1,25 +1,53 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from typing import Optional
 
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_read_db
 from src.repository import users as repository_users
 from src.conf.config import settings
+from src.services.cache import user_cache, token_cache
 
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    # bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+    hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="password-hash")
+    hash_slots = asyncio.Semaphore(settings.password_hash_concurrency)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-    def verify_password(self, plain_password, hashed_password):
+    @cached_property
+    def pwd_context(self):
+        # passlib is imported on the first login or signup, not when a worker starts
+        from passlib.context import CryptContext
+
+        return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+    async def run_hashing(self, func, *args):
+        """
+        The run_hashing function runs a bcrypt call in the hash_executor pool.
+            At most settings.password_hash_concurrency calls are submitted at once, the rest wait
+            on the event loop without holding a thread.
+        
+        :param self: Represent the instance of the class
+        :param func: The pwd_context method to call
+        :param args: The arguments of the call
+        :return: The result of the call
+        :doc-author: Trelent
+        """
+        async with self.hash_slots:
+            return await asyncio.get_running_loop().run_in_executor(self.hash_executor, func, *args)
+
+    async def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and the hashed version of that password,
             and returns True if they match, False otherwise. This is used to verify that the user's login
@@ -31,9 +59,23 @@ class Auth:
         :return: True if the password is correct and false otherwise
         :doc-author: Trelent
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await self.run_hashing(self.pwd_context.verify, plain_password, hashed_password)
 
-    def get_password_hash(self, password: str):
+    async def verify_and_update_password(self, plain_password, hashed_password):
+        """
+        The verify_and_update_password function verifies the password like verify_password and,
+            when the stored hash was made with another work factor than settings.bcrypt_rounds,
+            also returns a new hash of the password made with the current one.
+        
+        :param self: Represent the instance of the class
+        :param plain_password: Verify the password that is entered by the user
+        :param hashed_password: The hash stored for the user
+        :return: A tuple of the verification result and the new hash or None
+        :doc-author: Trelent
+        """
+        return await self.run_hashing(self.pwd_context.verify_and_update, plain_password, hashed_password)
+
+    async def get_password_hash(self, password: str):
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
             The function uses the pwd_context object to generate a hash from the given password.
@@ -43,7 +85,7 @@ class Auth:
         :return: A password hash
         :doc-author: Trelent
         """
-        return self.pwd_context.hash(password)
+        return await self.run_hashing(self.pwd_context.hash, password)
 
     # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -110,15 +152,33 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def decode_token(self, token: str) -> dict:
+        """
+        The decode_token function returns the claims of a token after checking its signature and expiry.
+            The signature of a token is checked once and then served from token_cache.
+        
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims of the token, JWTError is raised for an invalid token
+        :doc-author: Trelent
+        """
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            token_cache.set(token, payload)
+        return payload
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
         """
         The get_current_user function is a dependency that will be used in the
             UserController class. It takes a token as an argument and returns the user
             associated with that token. If no user is found, it raises an exception.
+            The user record is read through the Redis cache, so most requests need no database round trip,
+            and on a miss from a read replica when there is one.
         
         :param self: Represent the instance of a class
         :param token: str: Pass the token from the request header to this function
-        :param db: Session: Get the database session
+        :param db: AsyncSession: Get the database session
         :return: A user object
         :doc-author: Trelent
         """
@@ -130,7 +190,7 @@ class Auth:
 
         try:
             # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(token)
             if payload['scope'] == 'access_token':
                 email = payload["sub"]
                 if email is None:
@@ -140,9 +200,13 @@ class Auth:
         except JWTError as e:
             raise credentials_exception
 
-        user = await repository_users.get_user_by_email(email, db)
+        user = await user_cache.get(email)
         if user is None:
-            raise credentials_exception
+            user = await repository_users.get_user_by_email(email, db)
+            if user is None:
+                raise credentials_exception
+            expire = min(settings.user_cache_ttl, int(payload["exp"] - time.time()))
+            await user_cache.set(user, expire)
         return user
 
     def create_email_token(self, data: dict):
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from src.conf.config import settings
+
+# refuse images that would decode to more than ~16 MP instead of Pillow's 89 MP default
+MAX_IMAGE_PIXELS = 4096 * 4096
+
+
+class AvatarTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+async def read_upload(file: UploadFile, max_bytes: int, chunk_size: int = 64 * 1024) -> bytes:
+    """
+    The read_upload function reads the uploaded file chunk by chunk and stops as soon as it exceeds max_bytes,
+    so an oversized upload is never read into memory as a whole.
+
+    :param file: UploadFile: The uploaded file
+    :param max_bytes: int: The size cap in bytes
+    :param chunk_size: int: How much to read at a time
+    :return: The content of the file
+    :doc-author: Trelent
+    """
+    data = bytearray()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > max_bytes:
+            raise AvatarTooLarge(f"Avatar is larger than {max_bytes} bytes")
+    return bytes(data)
+
+
+def process_image(data: bytes, size: int) -> bytes:
+    """
+    The process_image function decodes an image, applies its EXIF orientation, crops it to a size x size square
+    and encodes it as JPEG. JPEGs are decoded at the smallest scale that still covers the target (draft mode),
+    which skips most of the decoding work for large photos.
+
+    :param data: bytes: The uploaded image
+    :param size: int: The width and height of the avatar
+    :return: The JPEG bytes of the avatar
+    :doc-author: Trelent
+    """
+    # Pillow is imported on the first upload, not when a worker starts
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image)
+            avatar = ImageOps.fit(image.convert("RGB"), (size, size), Image.Resampling.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        raise InvalidImage(str(err)) from err
+    output = io.BytesIO()
+    avatar.save(output, format="JPEG", quality=85, optimize=True)
+    return output.getvalue()
+
+
+class CloudinaryStorage:
+    """
+    Stores avatars in Cloudinary under a content-addressed public id, the upload runs in the threadpool.
+    The SDK is imported and configured on the first upload.
+    """
+
+    def __init__(self, folder: str = "NotesApp"):
+        self.folder = folder
+        self.uploader = None
+
+    def upload(self, data: bytes, public_id: str) -> dict:
+        if self.uploader is None:
+            import cloudinary
+            import cloudinary.uploader
+
+            cloudinary.config(
+                cloud_name=settings.cloudinary_name,
+                api_key=settings.cloudinary_api_key,
+                api_secret=settings.cloudinary_api_secret,
+                secure=True,
+            )
+            self.uploader = cloudinary.uploader
+        return self.uploader.upload(data, public_id=public_id, overwrite=False, resource_type="image")
+
+    async def save(self, key: str, data: bytes) -> str:
+        """
+        The save function uploads the avatar, an existing image with the same key is kept as it is.
+
+        :param self: Represent the instance of the class
+        :param key: str: The content hash of the avatar
+        :param data: bytes: The JPEG bytes
+        :return: The url of the stored avatar
+        :doc-author: Trelent
+        """
+        r = await run_in_threadpool(self.upload, data, f"{self.folder}/{key}")
+        return r["secure_url"]
+
+
+class LocalStorage:
+    """
+    Stores avatars as files named after their content hash, served by the application under base_url.
+    """
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = Path(directory)
+        self.base_url = base_url.rstrip("/")
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def write(self, path: Path, data: bytes):
+        if path.exists():
+            return
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    async def save(self, key: str, data: bytes) -> str:
+        """
+        The save function writes the avatar atomically, unless a file with the same content already exists.
+
+        :param self: Represent the instance of the class
+        :param key: str: The content hash of the avatar
+        :param data: bytes: The JPEG bytes
+        :return: The url of the stored avatar
+        :doc-author: Trelent
+        """
+        await run_in_threadpool(self.write, self.directory / f"{key}.jpg", data)
+        return f"{self.base_url}/{key}.jpg"
+
+
+class AvatarService:
+    """
+    Avatar pipeline: bounded read of the upload, decode and resize in a worker pool, content-addressed storage.
+    """
+
+    def __init__(self, storage, size: int, max_bytes: int, workers: int):
+        self.storage = storage
+        self.size = size
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="avatar")
+
+    @staticmethod
+    def key(avatar: bytes) -> str:
+        return hashlib.sha256(avatar).hexdigest()[:32]
+
+    async def upload(self, file: UploadFile, current_url: str | None) -> str | None:
+        """
+        The upload function turns the uploaded file into a stored 250x250 avatar.
+        The image is hashed after resizing, so uploading the same picture again does not reach the storage.
+
+        :param self: Represent the instance of the class
+        :param file: UploadFile: The uploaded file
+        :param current_url: str | None: The current avatar url of the user
+        :return: The url of the new avatar, or None when it is the same as the current one
+        :doc-author: Trelent
+        """
+        data = await read_upload(file, self.max_bytes)
+        loop = asyncio.get_running_loop()
+        avatar = await loop.run_in_executor(self.executor, process_image, data, self.size)
+        key = self.key(avatar)
+        if current_url and key in current_url:
+            return None
+        return await self.storage.save(key, avatar)
+
+
+if settings.avatar_storage == "local":
+    avatar_storage = LocalStorage(settings.avatar_local_dir, settings.avatar_local_url)
+else:
+    avatar_storage = CloudinaryStorage()
+
+avatar_service = AvatarService(avatar_storage, settings.avatar_size, settings.avatar_max_bytes, settings.avatar_workers)
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+
+from prometheus_client import REGISTRY
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.models import User
+from src.services.metrics import InstrumentedRedis, TokenCacheCollector
+
+
+class UserCache:
+    """
+    Users authenticated by get_current_user, by email. Only the fields the routes read from current_user
+    are stored, as JSON: no password hash or refresh token in Redis, and an entry does not depend
+    on the layout of the User model.
+    """
+    r = InstrumentedRedis(host=settings.redis_host, port=settings.redis_port, db=0)
+    prefix = "user:"
+    fields = ("id", "username", "email", "confirmed", "avatar", "created_at")
+
+    async def get(self, email: str) -> User | None:
+        """
+        The get function returns the cached user record for the given email, or None on a miss.
+        A Redis failure, or an entry in an older format, is treated as a miss, so authentication falls back to the database.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email (token sub) of the user
+        :return: A transient user object with the cached fields, or None
+        :doc-author: Trelent
+        """
+        try:
+            user = await self.r.get(self.prefix + email)
+        except RedisError as err:
+            print(err)
+            return None
+        if user is None:
+            return None
+        try:
+            user = json.loads(user)
+            if user["created_at"] is not None:
+                user["created_at"] = datetime.fromisoformat(user["created_at"])
+            return User(**{name: user[name] for name in self.fields})
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    async def set(self, user: User, expire: int) -> None:
+        """
+        The set function stores the user record for expire seconds.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user loaded from the database
+        :param expire: int: Time to live of the entry in seconds
+        :return: None
+        :doc-author: Trelent
+        """
+        if expire <= 0:
+            return
+        record = {name: getattr(user, name) for name in self.fields}
+        if record["created_at"] is not None:
+            record["created_at"] = record["created_at"].isoformat()
+        try:
+            await self.r.set(self.prefix + user.email, json.dumps(record), ex=expire)
+        except RedisError as err:
+            print(err)
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function drops the cached user record, it is called after every write to the user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the changed user
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            await self.r.delete(self.prefix + email)
+        except RedisError as err:
+            print(err)
+
+
+@lru_cache(maxsize=64)
+def cached_row_type(fields: tuple[str, ...]) -> type:
+    """
+    The cached_row_type function builds the row class of a cached page with the given columns.
+    Like a SQLAlchemy Row it has attribute access, _asdict() and _mapping, so the routes cannot tell them apart.
+
+    :param fields: tuple[str, ...]: The column names of the page
+    :return: A namedtuple class
+    :doc-author: Trelent
+    """
+    base = namedtuple("CachedContact", fields)
+    return type("CachedContact", (base,), {"__slots__": (), "_mapping": property(base._asdict)})
+
+
+class BirthdayCache:
+    """
+    Pages of upcoming birthdays, one Redis hash per user. A page is stored as JSON: its column names
+    and the rows as lists of values, so an entry does not depend on the layout of the Contact model.
+    """
+    r = UserCache.r
+    prefix = "birthdays:"
+    parsers = {"birthday": date.fromisoformat, "created_at": datetime.fromisoformat, "updated_at": datetime.fromisoformat}
+
+    async def get(self, user_id: int, key: str) -> list | None:
+        """
+        The get function returns the cached upcoming-birthdays page of the user, or None on a miss.
+        A Redis failure, or an entry in an older format, is treated as a miss.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :param key: str: Identify the page (contacts version, window, limit, offset, sort, cursor)
+        :return: A list of rows or None
+        :doc-author: Trelent
+        """
+        try:
+            page = await self.r.hget(self.prefix + str(user_id), key)
+        except RedisError as err:
+            print(err)
+            return None
+        if page is None:
+            return None
+        try:
+            page = json.loads(page)
+            fields = tuple(page["fields"])
+            parsers = [self.parsers.get(name) for name in fields]
+            row_type = cached_row_type(fields)
+            return [
+                row_type(*(value if parse is None or value is None else parse(value) for parse, value in zip(parsers, row)))
+                for row in page["rows"]
+            ]
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    async def set(self, user_id: int, key: str, contacts: list, expire_at: datetime) -> None:
+        """
+        The set function stores a page of upcoming birthdays; all pages of a user expire together at expire_at.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :param key: str: Identify the page
+        :param contacts: list: The rows to cache
+        :param expire_at: datetime: When the answer stops being valid (the next local midnight)
+        :return: None
+        :doc-author: Trelent
+        """
+        name = self.prefix + str(user_id)
+        page = {"fields": list(contacts[0]._fields) if contacts else [], "rows": [list(row) for row in contacts]}
+        try:
+            async with self.r.pipeline(transaction=True) as pipe:
+                await pipe.hset(name, key, json.dumps(page, default=lambda value: value.isoformat())).expireat(name, expire_at).execute()
+        except RedisError as err:
+            print(err)
+
+    async def invalidate(self, user_id: int) -> None:
+        """
+        The invalidate function drops every cached page of the user, it is called after each contact write.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the changed contacts
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            await self.r.delete(self.prefix + str(user_id))
+        except RedisError as err:
+            print(err)
+
+
+class ContactVersions:
+    """
+    Version tag of every user's contact book, the basis of the ETags of contact reads.
+    A bump stores a new random tag instead of incrementing, so a lost key can never bring back an old tag.
+    """
+    r = UserCache.r
+    prefix = "contacts_version:"
+    expire = 30 * 24 * 3600
+
+    async def get(self, user_id: int) -> str | None:
+        """
+        The get function returns the current version tag of the user's contacts, creating one on first use.
+        A Redis failure returns None and the caller answers without an ETag.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts
+        :return: The version tag or None
+        :doc-author: Trelent
+        """
+        name = self.prefix + str(user_id)
+        try:
+            version = await self.r.get(name)
+            if version is None:
+                async with self.r.pipeline(transaction=True) as pipe:
+                    _, version = await pipe.set(name, uuid.uuid4().hex, ex=self.expire, nx=True).get(name).execute()
+        except RedisError as err:
+            print(err)
+            return None
+        return version.decode() if version is not None else None
+
+    async def bump(self, user_id: int) -> None:
+        """
+        The bump function gives the user's contacts a new version tag, it is called after each contact write.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the changed contacts
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            await self.r.set(self.prefix + str(user_id), uuid.uuid4().hex, ex=self.expire)
+        except RedisError as err:
+            print(err)
+
+
+class ReadYourWrites:
+    """
+    Remembers for a few seconds that a user has written, so that user's reads go to the primary
+    until the replicas have caught up. Kept in Redis, so it holds across workers.
+    With no replicas configured the window is 0 and nothing is stored.
+    """
+    r = UserCache.r
+    prefix = "wrote:"
+
+    def __init__(self, window: int):
+        self.window = window
+
+    async def mark(self, email: str) -> None:
+        """
+        The mark function records a committed write of the user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user, as in the sub claim of their tokens
+        :return: None
+        :doc-author: Trelent
+        """
+        if self.window <= 0:
+            return
+        try:
+            await self.r.set(self.prefix + email, 1, ex=self.window)
+        except RedisError as err:
+            print(err)
+
+    async def recent(self, email: str) -> bool:
+        """
+        The recent function tells whether the user has written within the window.
+        When Redis fails it answers True, the primary is always safe to read from.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user, as in the sub claim of their tokens
+        :return: True if the reads of the user should go to the primary
+        :doc-author: Trelent
+        """
+        if self.window <= 0:
+            return False
+        try:
+            return bool(await self.r.exists(self.prefix + email))
+        except RedisError as err:
+            print(err)
+            return True
+
+
+class TokenCache:
+    """
+    In-process LRU of already verified JWTs: sha256 of the token -> claims.
+    Entries are dropped at the token's exp, so a token is verified about once per worker over its life.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        """
+        The key function digests the token, so the cache never holds usable credentials.
+
+        :param token: str: The encoded JWT
+        :return: The sha256 digest of the token
+        :doc-author: Trelent
+        """
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        """
+        The get function returns the claims of a token verified before, or None if it has to be verified.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The claims dict or None
+        :doc-author: Trelent
+        """
+        key = self.key(token)
+        entry = self.entries.get(key)
+        if entry is None or entry["exp"] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, token: str, claims: dict) -> None:
+        """
+        The set function remembers the claims of a verified token, evicting the least recently used entry when full.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :param claims: dict: The verified claims, they must contain exp
+        :return: None
+        :doc-author: Trelent
+        """
+        if self.maxsize <= 0 or "exp" not in claims:
+            return
+        key = self.key(token)
+        self.entries[key] = claims
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the size of the cache and its hit and miss counters.
+
+        :param self: Represent the instance of the class
+        :return: A dict with size, maxsize, hits and misses
+        :doc-author: Trelent
+        """
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
+birthday_cache = BirthdayCache()
+read_your_writes = ReadYourWrites(settings.db_read_your_writes if settings.sqlalchemy_replica_urls else 0)
+contact_versions = ContactVersions()
+token_cache = TokenCache(settings.token_cache_size)
+REGISTRY.register(TokenCacheCollector(token_cache))
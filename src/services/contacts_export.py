@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from src.repository import contacts as repository_contacts
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def dump_value(value):
+    """
+    The dump_value function renders dates and datetimes in ISO format for the JSON encoder.
+
+    :param value: Any value json cannot encode natively
+    :return: A string
+    :doc-author: Trelent
+    """
+    return value.isoformat()
+
+
+async def export_contacts(rows: AsyncIterator[list], export_format: str) -> AsyncIterator[str]:
+    """
+    The export_contacts function turns batches of contact rows into chunks of CSV or NDJSON text.
+    One chunk is produced per batch, so the response is written while the cursor is still being read
+    and a slow client slows down the reads instead of growing a buffer.
+
+    :param rows: AsyncIterator[list]: Batches of rows from repository_contacts.stream_contacts
+    :param export_format: str: csv or ndjson
+    :return: An async iterator of text chunks
+    :doc-author: Trelent
+    """
+    fields = [column.key for column in repository_contacts.EXPORT_COLUMNS]
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        async for batch in rows:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        async for batch in rows:
+            yield "".join(json.dumps(row._asdict(), default=dump_value, ensure_ascii=False) + "\n" for row in batch)
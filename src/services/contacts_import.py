@@ -0,0 +1,261 @@
+import codecs
+import csv
+import json
+import time
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactModel, ImportFormat
+
+CONTACT_FIELDS = ("name", "surname", "email", "phone", "birthday", "additional")
+
+CONTENT_TYPES = {
+    "text/csv": ImportFormat.csv,
+    "application/x-ndjson": ImportFormat.ndjson,
+    "application/jsonl": ImportFormat.ndjson,
+    "text/vcard": ImportFormat.vcard,
+    "text/x-vcard": ImportFormat.vcard,
+}
+
+
+def detect_format(content_type: str | None) -> ImportFormat | None:
+    """
+    The detect_format function maps the Content-Type of the upload to an import format.
+
+    :param content_type: str | None: The Content-Type header of the request
+    :return: The import format, or None if the type is unknown
+    :doc-author: Trelent
+    """
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The iter_lines function decodes a stream of byte chunks into text lines as they arrive,
+    so the upload is never held in memory as a whole.
+
+    :param stream: AsyncIterator[bytes]: The request body stream
+    :return: An async iterator of lines, each keeping its line ending
+    :doc-author: Trelent
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def parse_csv(lines: AsyncIterator[str]):
+    """
+    The parse_csv function reads CSV records with a header row.
+    Quoted fields may span several lines: a record is parsed once its quotes are balanced.
+
+    :param lines: AsyncIterator[str]: The lines of the upload
+    :return: An async iterator of (row number, row dict, error) tuples
+    :doc-author: Trelent
+    """
+    header = None
+    record = []
+    quotes = 0
+    number = 0
+    async for line in lines:
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        fields = next(csv.reader(record), [])
+        record = []
+        quotes = 0
+        if not any(field.strip() for field in fields):
+            continue
+        if header is None:
+            header = [field.strip().lower() for field in fields]
+            continue
+        number += 1
+        yield number, dict(zip(header, fields)), None
+    if record:
+        yield number + 1, None, "Unterminated quoted field"
+
+
+async def parse_ndjson(lines: AsyncIterator[str]):
+    """
+    The parse_ndjson function reads one JSON object per line.
+
+    :param lines: AsyncIterator[str]: The lines of the upload
+    :return: An async iterator of (row number, row dict, error) tuples
+    :doc-author: Trelent
+    """
+    number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, "Malformed JSON"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, row, None
+
+
+def vcard_unescape(value: str) -> str:
+    """
+    The vcard_unescape function decodes the backslash escapes of a vCard text value.
+
+    :param value: str: The raw property value
+    :return: The decoded text
+    :doc-author: Trelent
+    """
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def vcard_to_row(card: dict) -> dict:
+    """
+    The vcard_to_row function maps vCard properties to contact fields:
+    N (or FN) to name and surname, EMAIL, TEL, BDAY and NOTE to additional.
+
+    :param card: dict: The first value of every property of the card
+    :return: A row dict
+    :doc-author: Trelent
+    """
+    surname, name = (card.get("N", "").split(";") + ["", ""])[:2]
+    if not name and card.get("FN"):
+        name, _, full_surname = card["FN"].partition(" ")
+        surname = surname or full_surname
+    birthday = card.get("BDAY", "")
+    if len(birthday) == 8 and birthday.isdigit():
+        birthday = f"{birthday[:4]}-{birthday[4:6]}-{birthday[6:]}"
+    return {
+        "name": vcard_unescape(name),
+        "surname": vcard_unescape(surname),
+        "email": card.get("EMAIL"),
+        "phone": card.get("TEL"),
+        "birthday": birthday or None,
+        "additional": vcard_unescape(card.get("NOTE", "")),
+    }
+
+
+async def parse_vcard(lines: AsyncIterator[str]):
+    """
+    The parse_vcard function reads BEGIN:VCARD ... END:VCARD blocks, unfolding continuation lines.
+    Property parameters and groups (TEL;TYPE=cell, item1.EMAIL) are ignored and the first value wins.
+
+    :param lines: AsyncIterator[str]: The lines of the upload
+    :return: An async iterator of (row number, row dict, error) tuples
+    :doc-author: Trelent
+    """
+    number = 0
+    card = None
+    last = None
+    async for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if card is not None and last is not None:
+                card[last] += line[1:]
+            continue
+        last = None
+        if line.upper() == "BEGIN:VCARD":
+            card = {}
+        elif line.upper() == "END:VCARD" and card is not None:
+            number += 1
+            yield number, vcard_to_row(card), None
+            card = None
+        elif card is not None and ":" in line:
+            name, value = line.split(":", 1)
+            key = name.split(";")[0].rsplit(".", 1)[-1].upper()
+            if key not in card:
+                card[key] = value
+                last = key
+
+
+PARSERS = {
+    ImportFormat.csv: parse_csv,
+    ImportFormat.ndjson: parse_ndjson,
+    ImportFormat.vcard: parse_vcard,
+}
+
+
+async def import_contacts(stream: AsyncIterator[bytes], import_format: ImportFormat, current_user: User, db: AsyncSession) -> dict:
+    """
+    The import_contacts function streams an upload into the contacts of the user.
+    Rows are validated against ContactModel and written in chunks of settings.import_chunk_size,
+    one multi-row INSERT and one transaction per chunk. Invalid rows and emails that already exist are reported
+    by row number instead of failing the import.
+
+    :param stream: AsyncIterator[bytes]: The request body stream
+    :param import_format: ImportFormat: The format of the upload
+    :param current_user: User: The owner of the imported contacts
+    :param db: AsyncSession: Access the database
+    :return: A dict matching ImportReport
+    :doc-author: Trelent
+    """
+    started = time.perf_counter()
+    errors = []
+    total = imported = failed = 0
+
+    def reject(number: int, error: str):
+        nonlocal failed
+        failed += 1
+        if len(errors) < settings.import_max_errors:
+            errors.append({"row": number, "error": error})
+
+    async def flush(chunk: list):
+        nonlocal imported
+        inserted = await repository_contacts.create_contacts([body for _, body in chunk], current_user, db)
+        for number, body in chunk:
+            if body.email in inserted:
+                imported += 1
+            else:
+                reject(number, f"Contact with email {body.email} already exists")
+
+    chunk = []
+    emails = set()
+    async for number, row, error in PARSERS[import_format](iter_lines(stream)):
+        total += 1
+        if error:
+            reject(number, error)
+            continue
+        row = {field: row.get(field) for field in CONTACT_FIELDS}
+        if row["additional"] is None:
+            row["additional"] = ""
+        try:
+            body = ContactModel.model_validate(row)
+        except ValidationError as err:
+            reject(number, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in err.errors()))
+            continue
+        if body.email in emails:
+            reject(number, f"Duplicate email {body.email} in upload")
+            continue
+        emails.add(body.email)
+        chunk.append((number, body))
+        if len(chunk) >= settings.import_chunk_size:
+            await flush(chunk)
+            chunk = []
+            emails = set()
+    if chunk:
+        await flush(chunk)
+
+    seconds = time.perf_counter() - started
+    return {
+        "total": total,
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(total / seconds, 1) if seconds else 0.0,
+    }
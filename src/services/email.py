@@ -1,27 +1,216 @@
+import asyncio
+from email.message import EmailMessage
+from email.utils import formataddr
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
 from pydantic import EmailStr
 
 from src.services.auth import auth_service
 from src.conf.config import settings
 
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="hw13 part 1",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / "templates",
+@lru_cache(maxsize=None)
+def confirmation_template():
+    """
+    The confirmation_template function compiles the letter template on the first message, not at import,
+    and keeps it: templates are compiled once, not on every message.
+
+    :return: The compiled jinja2 template
+    :doc-author: Trelent
+    """
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    templates = Environment(loader=FileSystemLoader(Path(__file__).parent / "templates"), autoescape=select_autoescape())
+    return templates.get_template("email_template.html")
+
+
+class EmailSender:
+    """
+    Long-lived SMTP sender: a pool of authenticated connections fed from one queue.
+    Every worker owns a connection and takes one message at a time, so a burst is spread over all of them;
+    it reconnects only when the server drops the connection.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None = None, password: str | None = None,
+                 use_tls: bool = True, start_tls: bool = False, validate_certs: bool = True,
+                 pool_size: int = 4, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.loop = None
+        self.queue = None
+        self.workers = []
+        self.connections = set()
+
+    def start(self):
+        """
+        The start function starts the worker pool on the running event loop, once.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.connections = set()
+        self.workers = [loop.create_task(self.worker()) for _ in range(self.pool_size)]
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        The send function queues a message and waits until one of the pooled connections has sent it.
+
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message to send
+        :return: None, or raises the SMTP error of the delivery
+        :doc-author: Trelent
+        """
+        self.start()
+        future = self.loop.create_future()
+        await self.queue.put((message, future))
+        await future
+
+    async def connect(self) -> aiosmtplib.SMTP:
+        """
+        The connect function opens and authenticates a new SMTP connection.
+
+        :param self: Represent the instance of the class
+        :return: A connected SMTP client
+        :doc-author: Trelent
+        """
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname, port=self.port, username=self.username, password=self.password,
+            use_tls=self.use_tls, start_tls=self.start_tls, validate_certs=self.validate_certs, timeout=self.timeout,
+        )
+        await smtp.connect()
+        return smtp
+
+    @staticmethod
+    def settle(future: asyncio.Future, err: BaseException | None = None) -> None:
+        # the caller may have given up on send() (a request timeout), its future is then cancelled
+        if future.done():
+            return
+        if err is None:
+            future.set_result(None)
+        else:
+            future.set_exception(err)
+
+    @staticmethod
+    def closed() -> aiosmtplib.SMTPException:
+        return aiosmtplib.SMTPException("The email sender was closed before the message was sent")
+
+    async def worker(self):
+        """
+        The worker function sends queued messages over its own connection, one at a time.
+        A message that fails because the server closed an idle connection is retried once on a new one.
+        Any other error fails only the message it happened on, the worker goes on with the next one;
+        an unexpected one also drops the connection, which may be left in the middle of a transaction.
+        A worker cancelled in the middle of a message fails it, so its sender does not wait forever.
+
+        :param self: Represent the instance of the class
+        :return: None, it runs until cancelled
+        :doc-author: Trelent
+        """
+        smtp = None
+        future = None
+        try:
+            while True:
+                message, future = await self.queue.get()
+                for attempt in range(2):
+                    try:
+                        if smtp is None or not smtp.is_connected:
+                            smtp = await self.connect()
+                            self.connections.add(smtp)
+                        await smtp.send_message(message)
+                    except aiosmtplib.SMTPServerDisconnected as err:
+                        self.connections.discard(smtp)
+                        smtp = None
+                        if attempt:
+                            self.settle(future, err)
+                        continue
+                    except (aiosmtplib.SMTPException, OSError) as err:
+                        self.settle(future, err)
+                    except Exception as err:
+                        if smtp is not None:
+                            self.connections.discard(smtp)
+                            smtp.close()
+                            smtp = None
+                        self.settle(future, err)
+                    else:
+                        self.settle(future)
+                    break
+                self.queue.task_done()
+        finally:
+            if future is not None:
+                self.settle(future, self.closed())
+            if smtp is not None:
+                self.connections.discard(smtp)
+                smtp.close()
+
+    async def close(self):
+        """
+        The close function stops the workers and says QUIT on every open connection.
+        Messages that were not sent yet fail with an SMTPException.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        for smtp in list(self.connections):
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        while self.queue is not None and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            self.settle(future, self.closed())
+        self.loop = None
+        self.workers = []
+
+
+email_sender = EmailSender(
+    hostname=settings.mail_server,
+    port=settings.mail_port,
+    username=settings.mail_username,
+    password=settings.mail_password,
+    use_tls=settings.mail_ssl_tls,
+    start_tls=settings.mail_starttls,
+    pool_size=settings.mail_pool_size,
 )
 
+
+def confirmation_message(email: str, username: str, host: str) -> EmailMessage:
+    """
+    The confirmation_message function renders the email-confirmation letter for a user.
+
+    :param email: str: The address of the user
+    :param username: str: The username shown in the letter
+    :param host: str: The base url the confirmation link points to
+    :return: The message, ready for EmailSender.send
+    :doc-author: Trelent
+    """
+    token_verification = auth_service.create_email_token({"sub": email})
+    message = EmailMessage()
+    message["Subject"] = "Confirm your email "
+    message["From"] = formataddr(("hw13 part 1", settings.mail_from))
+    message["To"] = email
+    message.set_content(confirmation_template().render(host=host, username=username, token=token_verification), subtype="html")
+    return message
+
+
 async def send_email(email: EmailStr, username: str, host: str):
     """
     The send_email function sends an email to the user with a link to confirm their email address.
@@ -30,7 +219,7 @@ async def send_email(email: EmailStr, username: str, host: str):
     -email: the user's email address, which is used as a unique identifier for each account.
     -username: the username of the account that was just created. This is displayed in confirmation message sent to them via email.
     -host: this is used as part of URL that will be sent out in order for users to confirm their accounts.
-    
+
     :param email: EmailStr: Validate the email address
     :param username: str: Pass the username to the email template
     :param host: str: Pass the hostname of the server to be used in the email template
@@ -38,15 +227,6 @@ async def send_email(email: EmailStr, username: str, host: str):
     :doc-author: Trelent
     """
     try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
\ No newline at end of file
+        await email_sender.send(confirmation_message(email, username, host))
+    except (aiosmtplib.SMTPException, OSError) as err:
+        print(err)
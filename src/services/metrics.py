@@ -0,0 +1,230 @@
+import time
+
+import redis.asyncio as redis
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+HTTP_REQUESTS = Counter("http_requests", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Time spent serving HTTP requests", ["method", "route"])
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ["method"])
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "SQL statement execution time", ["statement"], buckets=FAST_BUCKETS)
+DB_QUERY_ERRORS = Counter("db_query_errors", "SQL statements that raised", ["statement"])
+DB_POOL_WAIT = Histogram("db_pool_checkout_seconds", "Time to get a connection from the pool", buckets=FAST_BUCKETS)
+DB_ADMISSION_REJECTED = Counter("db_admission_rejected", "Requests answered 503 because the connection pool was saturated")
+REDIS_DURATION = Histogram("redis_command_duration_seconds", "Redis round trips", ["command"], buckets=FAST_BUCKETS)
+
+STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+def route_name(scope) -> str:
+    """
+    The route_name function returns the path template of the route that served the request (/api/contacts/id/{contact_id}),
+    so every contact id does not become a metric series of its own.
+    It is called after the application has run: the router has then put the matched route into the scope,
+    so the request is not routed a second time.
+
+    :param scope: The ASGI scope of the served request
+    :return: The route path, or "unmatched"
+    :doc-author: Trelent
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # plain Starlette routes and mounts (docs, static files) only leave their endpoint
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return endpoint_paths(scope["app"]).get(endpoint, "unmatched")
+
+
+def endpoint_paths(app) -> dict:
+    """
+    The endpoint_paths function maps the endpoint of every route and mount of the app to its path, built once per app.
+
+    :param app: The application
+    :return: A dict of endpoint -> path
+    :doc-author: Trelent
+    """
+    paths = getattr(app.state, "endpoint_paths", None)
+    if paths is None:
+        paths = {}
+        for route in app.router.routes:
+            endpoint = getattr(route, "endpoint", None) or getattr(route, "app", None)
+            if endpoint is not None:
+                paths.setdefault(endpoint, route.path)
+        app.state.endpoint_paths = paths
+    return paths
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: counts requests and measures their latency per route.
+    It also sets the My-Process-Time header the application has always sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"my-process-time", str(time.perf_counter() - started).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        # the route is only known once the router has run, so requests in flight are counted per method
+        in_progress = HTTP_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            route = route_name(scope)
+            HTTP_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+
+def statement_type(statement: str) -> str:
+    keyword = statement.lstrip()[:6].upper()
+    return keyword if keyword in STATEMENTS else "OTHER"
+
+
+class TimedPoolMixin:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class PoolCollector:
+    """
+    Reads the connection pool counters of every instrumented engine at scrape time, so requests pay nothing for them.
+    """
+
+    def __init__(self):
+        self.engines = {}
+
+    def collect(self):
+        for name, documentation in (
+            ("size", "Connections the pool keeps open"),
+            ("checkedout", "Connections in use"),
+            ("checkedin", "Idle connections in the pool"),
+            ("overflow", "Connections opened beyond the pool size, negative while below it"),
+        ):
+            family = GaugeMetricFamily(f"db_pool_{name}", documentation, labels=["engine"])
+            for engine_name, engine in self.engines.items():
+                value = getattr(engine.pool, name, None)
+                if value is not None:
+                    family.add_metric([engine_name], value())
+            yield family
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+class TokenCacheCollector:
+    """
+    Exposes TokenCache.stats() at scrape time.
+    """
+
+    def __init__(self, token_cache):
+        self.token_cache = token_cache
+
+    def collect(self):
+        stats = self.token_cache.stats()
+        yield GaugeMetricFamily("token_cache_entries", "Verified tokens held in memory", value=stats["size"])
+        yield CounterMetricFamily("token_cache_hits", "Tokens served without verifying them", value=stats["hits"])
+        yield CounterMetricFamily("token_cache_misses", "Tokens that had to be verified", value=stats["misses"])
+
+
+def instrument_engine(engine, name: str = "primary") -> None:
+    """
+    The instrument_engine function times every SQL statement of the engine with cursor events
+    and registers the gauges of its connection pool.
+
+    :param engine: The Engine or AsyncEngine
+    :param name: str: The engine label of the pool gauges
+    :return: None
+    :doc-author: Trelent
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(statement_type(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        DB_QUERY_ERRORS.labels(statement_type(context.statement or "")).inc()
+
+    pool_collector.engines[name] = sync_engine
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Redis client that records the latency of every command and pipeline.
+    """
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        async def timed_execute(raise_on_error: bool = True):
+            started = time.perf_counter()
+            try:
+                return await execute(raise_on_error)
+            finally:
+                REDIS_DURATION.labels("PIPELINE").observe(time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    The render_metrics function renders every registered metric in the Prometheus text format.
+
+    :return: The body and its content type
+    :doc-author: Trelent
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,165 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import HTTPException, Request, Response, status
+from jose import JWTError
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+from src.services.cache import UserCache
+
+# Sliding window over two fixed windows: the previous window counts in proportion to the part of it
+# that is still inside the sliding window. One EVALSHA per check, the read and the increment are atomic.
+# KEYS: counter of the current window, counter of the previous one
+# ARGV: limit, window in ms, now in ms, cost, lease
+# Returns {1, remaining, granted lease} or {0, remaining, retry after in ms}
+SLIDING_WINDOW = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local lease = tonumber(ARGV[5])
+local current = tonumber(redis.call("GET", KEYS[1]) or "0")
+local previous = tonumber(redis.call("GET", KEYS[2]) or "0")
+local into = now % window
+local used = previous * (1 - into / window) + current
+if used + cost > limit then
+    local retry = window - into
+    if previous > 0 and limit - current - cost >= 0 then
+        retry = math.ceil((1 - (limit - current - cost) / previous) * window - into)
+    end
+    return {0, math.floor(limit - used), math.max(retry, 1)}
+end
+if used + cost + lease > limit then
+    lease = 0
+end
+redis.call("INCRBY", KEYS[1], cost + lease)
+redis.call("PEXPIRE", KEYS[1], window * 2)
+return {1, math.floor(limit - used - cost - lease), lease}
+"""
+
+
+class SlidingWindowLimiter:
+    """
+    Redis sliding-window limiter shared by all workers.
+    With a lease fraction above 0 a caller far from its limit takes a small part of its budget in advance
+    and spends it in process, so its next requests need no Redis round trip. Leased units are counted in Redis,
+    so leases can only make the limit stricter, never looser.
+    """
+    r = UserCache.r
+    prefix = "ratelimit:"
+
+    def __init__(self, lease_fraction: float = 0.0, maxsize: int = 10000):
+        self.lease_fraction = lease_fraction
+        self.maxsize = maxsize
+        self.leases = OrderedDict()
+        self.script = self.r.register_script(SLIDING_WINDOW)
+
+    async def hit(self, key: str, limit: int, seconds: int, cost: int = 1) -> tuple[bool, int, float]:
+        """
+        The hit function spends cost units of the budget of key, if it has them.
+
+        :param self: Represent the instance of the class
+        :param key: str: Identify the caller and the budget
+        :param limit: int: The budget per window
+        :param seconds: int: The length of the window
+        :param cost: int: The units the request costs
+        :return: A tuple of (allowed, remaining units, seconds to wait before retrying)
+        :doc-author: Trelent
+        """
+        now = int(time.time() * 1000)
+        window = seconds * 1000
+        index = now // window
+        lease = self.leases.get(key)
+        if lease is not None and lease[0] == index and lease[1] >= cost:
+            lease[1] -= cost
+            return True, lease[1] + lease[2], 0.0
+        lease_size = int(limit * self.lease_fraction)
+        try:
+            allowed, remaining, extra = await self.script(
+                keys=[f"{self.prefix}{key}:{index}", f"{self.prefix}{key}:{index - 1}"],
+                args=[limit, window, now, cost, lease_size],
+            )
+        except RedisError as err:
+            # fail open: an unavailable Redis must not take the API down
+            print(err)
+            return True, limit, 0.0
+        if not allowed:
+            return False, max(remaining, 0), extra / 1000
+        if extra:
+            self.leases[key] = [index, extra, remaining]
+            self.leases.move_to_end(key)
+            while len(self.leases) > self.maxsize:
+                self.leases.popitem(last=False)
+        return True, remaining + extra, 0.0
+
+
+limiter = SlidingWindowLimiter(settings.rate_limit_lease)
+
+
+def client_key(request: Request) -> str:
+    """
+    The client_key function identifies the caller: the user of a valid bearer token, otherwise the client address.
+
+    :param request: Request: The incoming request
+    :return: The key of the caller's budget
+    :doc-author: Trelent
+    """
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return "user:" + auth_service.decode_token(token)["sub"]
+        except (JWTError, KeyError):
+            pass
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def limit_cost(request: Request, per_items: int = 100) -> int:
+    """
+    The limit_cost function charges list requests by page size: one unit per per_items requested rows.
+
+    :param request: Request: The incoming request
+    :param per_items: int: The page size one unit pays for
+    :return: The number of units
+    :doc-author: Trelent
+    """
+    try:
+        limit = int(request.query_params.get("limit", 0))
+    except ValueError:
+        return 1
+    return max(1, math.ceil(limit / per_items))
+
+
+class RateLimiter:
+    """
+    Dependency that applies one budget to every route of a router:
+
+        router = APIRouter(dependencies=[Depends(RateLimiter("contacts", times=120, seconds=60))])
+
+    costs maps endpoint function names to their cost (bcrypt-heavy routes cost more), and the cost
+    is multiplied by the page size units of limit_cost.
+    """
+
+    def __init__(self, name: str, times: int, seconds: int, costs: dict[str, int] | None = None,
+                 cost: Callable[[Request], int] = limit_cost):
+        self.name = name
+        self.times = times
+        self.seconds = seconds
+        self.costs = costs or {}
+        self.cost = cost
+
+    async def __call__(self, request: Request, response: Response):
+        if not settings.rate_limit_enabled:
+            return
+        endpoint = request.scope.get("endpoint")
+        cost = self.costs.get(getattr(endpoint, "__name__", ""), 1) * self.cost(request)
+        allowed, remaining, retry_after = await limiter.hit(f"{self.name}:{client_key(request)}", self.times, self.seconds, cost)
+        headers = {"X-RateLimit-Limit": str(self.times), "X-RateLimit-Remaining": str(remaining)}
+        if not allowed:
+            headers["Retry-After"] = str(math.ceil(retry_after))
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests", headers=headers)
+        response.headers.update(headers)
@@ -0,0 +1,43 @@
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+
+
+class BodySizeLimitMiddleware:
+    """
+    Pure ASGI middleware: caps the request body of the given paths before the application reads it.
+    A declared Content-Length over the limit is answered 413 without reading anything; a body without one
+    (chunked) is counted as it arrives and cut off at the limit. File() parameters are parsed, and spooled
+    to disk, before any dependency or route code runs, so this is the only place the cap bounds the upload.
+    """
+
+    def __init__(self, app, limits: dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    @staticmethod
+    def too_large(limit: int) -> str:
+        return f"Request body is larger than {limit} bytes"
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            response = JSONResponse({"detail": self.too_large(limit)}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # raised inside the body parsing, FastAPI passes it on to the exception handlers
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=self.too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,171 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from jose import jwt
+from starlette.requests import Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from src.database import db
+from src.database.db import AdmissionController, AdmittedQueuePool, PoolAdmissionError, ReplicaRouter
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_admit_up_to_limit(self):
+        admission = AdmissionController(capacity=2, queue_limit=1)
+        for _ in range(3):
+            admission.admit()
+        with self.assertRaises(PoolAdmissionError):
+            admission.admit()
+        admission.release()
+        admission.admit()
+        self.assertEqual(admission.active, 3)
+
+
+class TestAdmittedQueuePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = AdmittedQueuePool(MagicMock, pool_size=1, max_overflow=0, timeout=0.01)
+        self.pool.admission = AdmissionController(capacity=1, queue_limit=0)
+
+    def test_checkout_takes_a_place_until_checkin(self):
+        connection = self.pool.connect()
+        self.assertEqual(self.pool.admission.active, 1)
+        with self.assertRaises(PoolAdmissionError):
+            self.pool.connect()
+        connection.close()
+        self.assertEqual(self.pool.admission.active, 0)
+        self.pool.connect().close()
+        self.assertEqual(self.pool.admission.active, 0)
+
+    def test_failed_connect_gives_place_back(self):
+        pool = AdmittedQueuePool(MagicMock(side_effect=OSError("refused")), pool_size=1, max_overflow=0)
+        with self.assertRaises(OSError):
+            pool.connect()
+        self.assertEqual(pool.admission.active, 0)
+
+
+class TestGetDb(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch.object(db, "DBSession", return_value=MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_pool_timeout_is_503(self):
+        generator = db.get_db(Request({"type": "http"}))
+        await generator.__anext__()
+        with self.assertRaises(HTTPException) as raised:
+            await generator.athrow(PoolAdmissionError("pool is full"))
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertIn("Retry-After", raised.exception.headers)
+
+
+class TestSessionAdmission(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=AdmittedQueuePool, pool_size=1, max_overflow=0)
+        self.engine.pool.admission = AdmissionController(capacity=1, queue_limit=0)
+        for target, value in (("engine", self.engine), ("DBSession", sessionmaker(bind=self.engine))):
+            patcher = patch.object(db, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(db.settings, "sqlalchemy_async_mode", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_sessions_without_queries_take_no_place(self):
+        # requests answered from the user cache or with 304 open a session but never check out a connection
+        generators = [db.get_db(Request({"type": "http"})) for _ in range(3)]
+        sessions = [await generator.__anext__() for generator in generators]
+        self.assertEqual(self.engine.pool.admission.active, 0)
+        await sessions[0].execute(text("SELECT 1"))
+        self.assertEqual(self.engine.pool.admission.active, 1)
+        with self.assertRaises(PoolAdmissionError):
+            await sessions[1].execute(text("SELECT 1"))
+        for generator in generators:
+            await generator.aclose()
+        self.assertEqual(self.engine.pool.admission.active, 0)
+
+
+class TestPrewarmPool(unittest.IsolatedAsyncioTestCase):
+    async def test_closes_opened_connections_when_one_fails(self):
+        opened = MagicMock()
+        engine = MagicMock()
+        engine.connect.side_effect = [opened, OperationalError("connect", {}, OSError("refused")), opened]
+        with patch.object(db, "engine", engine), patch.object(db, "DBSession", MagicMock()), \
+                patch.object(db.settings, "sqlalchemy_async_mode", False), patch.object(db.settings, "db_pool_size", 3):
+            with self.assertLogs(db.logger):
+                await db.prewarm_pool(3)
+        self.assertEqual(opened.close.call_count, 2)
+
+
+class TestReplicaRouter(unittest.TestCase):
+    def test_round_robin_skips_lagging(self):
+        router = ReplicaRouter(["first", "second", "third"], max_lag=5.0, interval=1.0)
+        self.assertIsNone(router.pick())
+        router.lags = [0.0, 30.0, 1.0]
+        self.assertEqual([router.pick() for _ in range(4)], ["first", "third", "first", "third"])
+        router.lags = [float("inf")] * 3
+        self.assertIsNone(router.pick())
+
+    def test_bind_waits_for_first_check(self):
+        router = ReplicaRouter([], max_lag=5.0, interval=1.0)
+        self.assertIsNone(router.pick())
+        router.bind(["first", "second"])
+        self.assertIsNone(router.pick())
+        router.lags = [0.0, 0.0]
+        self.assertEqual([router.pick() for _ in range(2)], ["first", "second"])
+
+
+class TestReplicaCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_logs_only_reachability_changes(self):
+        router = ReplicaRouter(["replica"], max_lag=5.0, interval=1.0)
+        with patch.object(router, "lag", AsyncMock(side_effect=[OSError("refused"), OSError("refused"), 0.5])):
+            with self.assertLogs(db.logger) as logs:
+                for _ in range(3):
+                    await router.check()
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn("unreachable", logs.records[0].getMessage())
+        self.assertIn("reachable again", logs.records[1].getMessage())
+        self.assertEqual(router.lags, [0.5])
+
+
+class TestGetReadDb(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        router = ReplicaRouter(["replica"], max_lag=5.0, interval=1.0)
+        router.lags = [0.0]
+        for target, value in (("replicas", router), ("DBSession", MagicMock()), ("read_your_writes", AsyncMock())):
+            patcher = patch.object(db, target, value)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.read_your_writes.recent.return_value = False
+        self.request = Request({"type": "http", "headers": [(b"authorization", b"Bearer " + self.token().encode())]})
+
+    @staticmethod
+    def token() -> str:
+        return jwt.encode({"sub": "test@test.com", "scope": "access_token"}, "key", algorithm="HS256")
+
+    async def test_reads_from_replica(self):
+        generator = db.get_read_db(self.request)
+        await generator.__anext__()
+        self.DBSession.assert_called_once_with(bind="replica")
+        self.read_your_writes.recent.assert_awaited_once_with("test@test.com")
+        await generator.aclose()
+
+    async def test_own_write_reads_from_primary(self):
+        self.read_your_writes.recent.return_value = True
+        generator = db.get_read_db(self.request)
+        await generator.__anext__()
+        self.DBSession.assert_called_once_with()
+        self.assertIsNotNone(self.request.state.primary_db)
+        await generator.aclose()
+
+    async def test_streamed_session_is_not_shared(self):
+        self.read_your_writes.recent.return_value = True
+        async with db.read_session(self.request, shared=False):
+            self.assertIsNone(getattr(self.request.state, "primary_db", None))
+        self.DBSession.return_value.close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
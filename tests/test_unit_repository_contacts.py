@@ -1,50 +1,124 @@
 import unittest
-from unittest.mock import MagicMock
-from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+from datetime import datetime, date
 
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact, User
-from src.schemas import ContactModel
+from src.schemas import ContactModel, ContactPatch, ContactBatchUpdateItem
 from src.repository.contacts import (
     get_all_contacts,
+    contact_columns,
+    CONTACT_COLUMNS,
+    encode_cursor,
+    next_cursor,
     get_contact_by_id,
     get_contact_by_name,
     get_contact_by_surname,
     get_contact_by_email,
+    search_contacts,
     get_birthdays_in_next_week,
+    day_of_year,
     create_contact,
+    create_contacts,
     update_contact,
+    patch_contact,
     remove_contact,
+    get_contacts_batch,
+    update_contacts_batch,
+    remove_contacts_batch,
+    get_contacts_total,
 )
 
 class TestContacts(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
+        patcher = patch("src.repository.contacts.birthday_cache", AsyncMock())
+        self.birthday_cache = patcher.start()
+        self.birthday_cache.get.return_value = None
+        self.addCleanup(patcher.stop)
+        patcher = patch("src.repository.contacts.contact_versions", AsyncMock())
+        self.contact_versions = patcher.start()
+        self.contact_versions.get.return_value = "v1"
+        self.addCleanup(patcher.stop)
         self.user = User(id=1)
 
     async def test_get_all_contacts(self):
         test_contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().limit().offset().all.return_value = (
+        self.session.execute.return_value.all.return_value = (
             test_contacts
         )
         result = await get_all_contacts(10, 0, self.user, self.session)
         self.assertEqual(result, test_contacts)
 
+    def test_contact_columns(self):
+        self.assertEqual(contact_columns(), CONTACT_COLUMNS)
+        columns = contact_columns(("phone", "id"), "name")
+        self.assertEqual([column.key for column in columns], ["id", "phone", "name"])
+
+    async def test_get_all_contacts_fields(self):
+        self.session.execute.return_value.all.return_value = []
+        await get_all_contacts(10, 0, self.user, self.session, "id", None, ("name", "phone"))
+        stmt = self.session.execute.await_args.args[0]
+        self.assertEqual([column.key for column in stmt.selected_columns], ["id", "name", "phone"])
+
+    async def test_get_all_contacts_with_cursor(self):
+        test_contacts = [Contact(), Contact()]
+        self.session.execute.return_value.all.return_value = (
+            test_contacts
+        )
+        cursor = encode_cursor(Contact(id=7, name="Max"), "name")
+        result = await get_all_contacts(2, 0, self.user, self.session, "name", cursor)
+        self.assertEqual(result, test_contacts)
+
+    async def test_get_all_contacts_null_cursor(self):
+        self.session.execute.return_value.all.return_value = []
+        await get_all_contacts(2, 0, self.user, self.session, "birthday", encode_cursor(Contact(id=7), "birthday"))
+        where = str(self.session.execute.await_args.args[0].whereclause)
+        self.assertIn("contacts.birthday IS NULL AND contacts.id >", where)
+        await get_all_contacts(2, 0, self.user, self.session, "birthday", encode_cursor(Contact(id=7, birthday=date(2000, 1, 1)), "birthday"))
+        # the seek stays a pure row comparison the (user_id, birthday, id) index can range-scan
+        sql = str(self.session.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+        self.assertNotIn(" OR ", sql)
+        self.assertIn("(contacts.birthday, contacts.id) >", sql)
+        self.assertIn("UNION ALL", sql)
+
+    async def test_get_all_contacts_invalid_cursor(self):
+        cursor = encode_cursor(Contact(id=7, name="Max"), "name")
+        with self.assertRaises(ValueError):
+            await get_all_contacts(2, 0, self.user, self.session, "surname", cursor)
+        with self.assertRaises(ValueError):
+            await get_all_contacts(2, 0, self.user, self.session, "id", "not a cursor")
+
+    async def test_next_cursor(self):
+        contacts = [Contact(id=1), Contact(id=2)]
+        self.assertIsNone(next_cursor(contacts, 3))
+        self.assertEqual(next_cursor(contacts, 2), encode_cursor(contacts[-1]))
+
     async def test_get_contact_by_id(self):
         test_contact = Contact()
-        self.session.query().filter_by().first.return_value = test_contact
+        self.session.execute.return_value.first.return_value = test_contact
         result = await get_contact_by_id(1, self.user, self.session)
         self.assertEqual(result, test_contact)
+        stmt = self.session.execute.await_args.args[0]
+        self.assertEqual(set(stmt.compile().params), {"id_1", "user_id_1"})
+
+    async def test_get_contact_by_id_with_updated_at(self):
+        await get_contact_by_id(1, self.user, self.session, ("phone",), with_updated_at=True)
+        stmt = self.session.execute.await_args.args[0]
+        self.assertEqual([column.name for column in stmt.selected_columns], ["id", "phone", "updated_at"])
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.session.execute.return_value.first.return_value = None
         result = await get_contact_by_id(1, self.user, self.session)
         self.assertIsNone(result)
 
     async def test_get_contact_by_name(self):
         test_contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().limit().offset().all.return_value = (
+        self.session.execute.return_value.all.return_value = (
             test_contacts
         )
         result = await get_contact_by_name("Max", 10, 0, self.user, self.session)
@@ -52,7 +126,7 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     async def test_get_contact_by_surname(self):
         test_contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().limit().offset().all.return_value = (
+        self.session.execute.return_value.all.return_value = (
             test_contacts
         )
         result = await get_contact_by_surname("Jonson", 10, 0, self.user, self.session)
@@ -60,17 +134,52 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     async def test_get_contact_by_email(self):
         test_contact = Contact()
-        self.session.query().filter_by().first.return_value = test_contact
+        self.session.execute.return_value.first.return_value = test_contact
         result = await get_contact_by_email("test@test.com", self.user, self.session)
         self.assertEqual(result, test_contact)
 
+    async def test_search_contacts(self):
+        test_contacts = [Contact(), Contact()]
+        self.session.execute.return_value.all.return_value = test_contacts
+        result = await search_contacts("jon smi", 10, 0, self.user, self.session)
+        self.assertEqual(result, test_contacts)
+
+    async def test_search_contacts_without_words(self):
+        result = await search_contacts("&!", 10, 0, self.user, self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_awaited()
+
     async def test_get_birthdays_in_next_week(self):
         test_contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().limit().offset().all.return_value = test_contacts
+        self.session.execute.return_value.all.return_value = test_contacts
         result = await get_birthdays_in_next_week(
             10, 0, self.user, self.session
         )
         self.assertEqual(result, test_contacts)
+        self.birthday_cache.set.assert_awaited_once()
+        self.assertTrue(self.birthday_cache.set.await_args.args[1].startswith("v1:"))
+
+    async def test_get_birthdays_in_next_week_without_version(self):
+        self.contact_versions.get.return_value = None
+        self.session.execute.return_value.all.return_value = [Contact()]
+        await get_birthdays_in_next_week(10, 0, self.user, self.session)
+        self.birthday_cache.get.assert_not_awaited()
+        self.birthday_cache.set.assert_not_awaited()
+
+    async def test_get_birthdays_in_next_week_cached(self):
+        test_contacts = [Contact(), Contact()]
+        self.birthday_cache.get.return_value = test_contacts
+        result = await get_birthdays_in_next_week(
+            10, 0, self.user, self.session, days=30
+        )
+        self.assertEqual(result, test_contacts)
+        self.session.execute.assert_not_awaited()
+
+    def test_day_of_year(self):
+        self.assertEqual(day_of_year(date(2023, 1, 1)), 1)
+        self.assertEqual(day_of_year(date(2023, 3, 1)), 61)
+        self.assertEqual(day_of_year(date(2024, 2, 29)), 60)
+        self.assertEqual(day_of_year(date(2023, 12, 31)), 366)
 
     async def test_create_contact(self):
         birthday_date = datetime.strptime("2000-10-10", "%Y-%m-%d").date()
@@ -82,6 +191,7 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             birthday=birthday_date,
             additional="t3st",
         )
+        self.session.execute.return_value.first.return_value = Contact(id=1, **body.model_dump())
         result = await create_contact(body, self.user, self.session)
         self.assertEqual(result.name, body.name)
         self.assertEqual(result.surname, body.surname)
@@ -89,6 +199,22 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.phone, body.phone)
         self.assertEqual(str(result.birthday), str(body.birthday))
         self.assertTrue(hasattr(result, "id"))
+        self.assertEqual(self.session.execute.await_count, 2)
+        self.contact_versions.bump.assert_awaited_once_with(self.user.id)
+
+    async def test_create_contacts(self):
+        birthday_date = datetime.strptime("2000-10-10", "%Y-%m-%d").date()
+        bodies = [
+            ContactModel(name="name", surname="surname", email=f"test{i}@email.com", phone="1234456", birthday=birthday_date, additional="")
+            for i in range(3)
+        ]
+        self.session.execute.return_value.scalars.return_value.all.return_value = ["test0@email.com", "test2@email.com"]
+        result = await create_contacts(bodies, self.user, self.session)
+        self.assertEqual(result, {"test0@email.com", "test2@email.com"})
+        count = self.session.execute.await_args.args[0]
+        self.assertEqual(count.table.name, "users")
+        self.assertIn(2, count.compile().params.values())
+        self.session.commit.assert_awaited_once()
 
     async def test_update_contact(self):
         birthday_date = datetime.strptime("2000-10-10", "%Y-%m-%d").date()
@@ -101,10 +227,11 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             additional="t3st",
         )
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
+        self.session.execute.return_value.first.return_value = contact
         self.session.commit.return_value = None
-        result = await update_contact(body, contact, self.user, self.session)
+        result = await update_contact(body, 1, self.user, self.session)
         self.assertEqual(result, contact)
+        self.contact_versions.bump.assert_awaited_once_with(self.user.id)
 
     async def test_update_contact_not_found(self):
         birthday_date = datetime.strptime("2000-10-10", "%Y-%m-%d").date()
@@ -117,22 +244,108 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             additional="t3st",
         )
         contact = Contact()
-        self.session.query().filter_by().first.return_value = None
+        self.session.execute.return_value.first.return_value = None
         self.session.commit.return_value = None
-        result = await update_contact(body, contact, self.user, self.session)
+        result = await update_contact(body, 1, self.user, self.session)
         self.assertIsNone(result)
+        self.contact_versions.bump.assert_not_awaited()
+
+    async def test_patch_contact(self):
+        contact = Contact(id=1, phone="5550000")
+        self.session.execute.return_value.first.return_value = contact
+        result = await patch_contact(ContactPatch(phone="5550000"), 1, self.user, self.session)
+        self.assertEqual(result, contact)
+        stmt = self.session.execute.await_args.args[0]
+        self.assertEqual(set(stmt.compile().params), {"id_1", "user_id_1", "phone_1", "phone"})
+        self.session.commit.assert_awaited_once()
+        self.contact_versions.bump.assert_awaited_once_with(self.user.id)
+
+    async def test_patch_contact_unchanged(self):
+        contact = Contact(id=1, phone="5550000")
+        self.session.execute.return_value.first.side_effect = [None, contact]
+        result = await patch_contact(ContactPatch(phone="5550000"), 1, self.user, self.session)
+        self.assertEqual(result, contact)
+        self.assertEqual(self.session.execute.await_count, 2)
+        self.session.commit.assert_not_awaited()
+        self.contact_versions.bump.assert_not_awaited()
+
+    def test_patch_contact_rejects_null(self):
+        with self.assertRaises(ValidationError):
+            ContactPatch(birthday=None)
+        self.assertEqual(ContactPatch(phone="5550000").model_dump(exclude_unset=True), {"phone": "5550000"})
+
+    async def test_patch_contact_empty(self):
+        self.session.execute.return_value.first.return_value = None
+        result = await patch_contact(ContactPatch(), 1, self.user, self.session)
+        self.assertIsNone(result)
+        self.session.execute.assert_awaited_once()
+        self.session.commit.assert_not_awaited()
 
     async def test_remove_contact(self):
         contact = Contact()
-        self.session.query().filter_by().first.return_value = contact
+        self.session.execute.return_value.first.return_value = contact
         result = await remove_contact(1, self.user, self.session)
         self.assertEqual(result, contact)
+        self.session.delete.assert_not_called()
+        self.contact_versions.bump.assert_awaited_once_with(self.user.id)
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter_by().first.return_value = None
+        self.session.execute.return_value.first.return_value = None
         result = await remove_contact(1, self.user, self.session)
         self.assertIsNone(result)
 
 
+    async def test_get_contacts_total(self):
+        self.session.scalar.return_value = 42
+        result = await get_contacts_total(self.user, self.session)
+        self.assertEqual(result, 42)
+
+    async def test_get_contacts_batch_empty(self):
+        result = await get_contacts_batch([], [], self.user, self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_awaited()
+
+    @staticmethod
+    def result(rows=(), contacts=()) -> MagicMock:
+        result = MagicMock()
+        result.all.return_value = list(rows)
+        result.scalars.return_value.all.return_value = list(contacts)
+        return result
+
+    async def test_update_contacts_batch(self):
+        self.session.execute.side_effect = [
+            self.result(rows=[(3, "taken@test.com")]),
+            self.result(contacts=[Contact(id=1)]),
+            self.result(contacts=[Contact(id=5)]),
+        ]
+        items = [
+            ContactBatchUpdateItem(id=1, phone="555"),
+            ContactBatchUpdateItem(id=2, email="taken@test.com"),
+            ContactBatchUpdateItem(id=4, name="name"),
+            ContactBatchUpdateItem(id=5),
+        ]
+        result = await update_contacts_batch(items, self.user, self.session)
+        self.assertEqual([item["status"] for item in result], ["updated", "conflict", "not_found", "unchanged"])
+        update_params = self.session.execute.await_args_list[1].args[0].compile().params
+        self.assertNotIn(5, update_params.values())
+        self.assertEqual(self.session.execute.await_args_list[2].args[0].compile().params["id_1"], [4, 5])
+        self.session.commit.assert_awaited_once()
+        self.contact_versions.bump.assert_awaited_once_with(self.user.id)
+
+    async def test_update_contacts_batch_unchanged(self):
+        self.session.execute.side_effect = [self.result(), self.result(contacts=[Contact(id=1)])]
+        result = await update_contacts_batch([ContactBatchUpdateItem(id=1, phone="555")], self.user, self.session)
+        self.assertEqual(result[0]["status"], "unchanged")
+        self.session.commit.assert_not_awaited()
+        self.contact_versions.bump.assert_not_awaited()
+
+    async def test_remove_contacts_batch(self):
+        self.session.execute.return_value.scalars.return_value.all.return_value = [1]
+        result = await remove_contacts_batch([1, 2], self.user, self.session)
+        self.assertEqual(result, [{"id": 1, "status": "deleted"}, {"id": 2, "status": "not_found"}])
+        self.assertIn(-1, self.session.execute.await_args.args[0].compile().params.values())
+        self.session.commit.assert_awaited_once()
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
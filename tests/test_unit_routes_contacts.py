@@ -0,0 +1,35 @@
+import unittest
+
+from fastapi import Response
+from starlette.requests import Request
+
+from src.routes.contacts import CACHE_CONTROL, not_modified
+
+
+class TestNotModified(unittest.TestCase):
+    def setUp(self):
+        self.response = Response()
+        del self.response.headers["content-length"]
+        self.response.headers.update({"X-RateLimit-Limit": "300", "X-RateLimit-Remaining": "299"})
+        self.response.headers.append("Vary", "Authorization")
+        self.response.headers.append("Vary", "Accept-Encoding")
+
+    @staticmethod
+    def request(if_none_match: str | None = None) -> Request:
+        headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+        return Request({"type": "http", "headers": headers})
+
+    def test_304_keeps_headers_of_dependencies(self):
+        cached = not_modified(self.request('W/"tag"'), self.response, '"tag"')
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.headers["ETag"], '"tag"')
+        self.assertEqual(cached.headers["Cache-Control"], CACHE_CONTROL)
+        self.assertEqual(cached.headers["X-RateLimit-Limit"], "300")
+        self.assertEqual(cached.headers["X-RateLimit-Remaining"], "299")
+        self.assertEqual(cached.headers.getlist("Vary"), ["Authorization", "Accept-Encoding"])
+        self.assertNotIn("content-length", cached.headers)
+
+    def test_changed_representation(self):
+        self.assertIsNone(not_modified(self.request('"old"'), self.response, '"tag"'))
+        self.assertEqual(self.response.headers["ETag"], '"tag"')
+        self.assertIsNone(not_modified(self.request(), self.response, '"tag"'))
@@ -0,0 +1,42 @@
+import io
+import tempfile
+import unittest
+
+from fastapi import UploadFile
+from PIL import Image
+
+from src.services.avatars import AvatarService, AvatarTooLarge, InvalidImage, LocalStorage, process_image
+
+
+def make_image(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), (10, 120, 200)).save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestAvatars(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.service = AvatarService(LocalStorage(self.directory.name, "/avatars"), size=250, max_bytes=100_000, workers=1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_process_image(self):
+        avatar = Image.open(io.BytesIO(process_image(make_image(800, 400), 250)))
+        self.assertEqual(avatar.size, (250, 250))
+        self.assertEqual(avatar.format, "JPEG")
+
+    def test_process_image_invalid(self):
+        with self.assertRaises(InvalidImage):
+            process_image(b"not an image", 250)
+
+    async def test_upload_skips_unchanged(self):
+        data = make_image(300, 300)
+        url = await self.service.upload(UploadFile(io.BytesIO(data)), None)
+        self.assertTrue(url.startswith("/avatars/"))
+        self.assertIsNone(await self.service.upload(UploadFile(io.BytesIO(data)), url))
+
+    async def test_upload_too_large(self):
+        with self.assertRaises(AvatarTooLarge):
+            await self.service.upload(UploadFile(io.BytesIO(b"x" * 200_000)), None)
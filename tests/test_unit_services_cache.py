@@ -0,0 +1,97 @@
+import json
+import pickle
+import time
+import unittest
+from collections import namedtuple
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.database.models import User
+from src.services.cache import BirthdayCache, TokenCache, UserCache
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.claims = {"sub": "test@test.com", "scope": "access_token", "exp": time.time() + 60}
+
+    def test_get_miss_then_hit(self):
+        self.assertIsNone(self.cache.get("token"))
+        self.cache.set("token", self.claims)
+        self.assertEqual(self.cache.get("token"), self.claims)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_expired_token(self):
+        self.cache.set("token", dict(self.claims, exp=time.time() - 1))
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("first", self.claims)
+        self.cache.set("second", self.claims)
+        self.cache.get("first")
+        self.cache.set("third", self.claims)
+        self.assertIsNone(self.cache.get("second"))
+        self.assertEqual(self.cache.get("first"), self.claims)
+        self.assertEqual(self.cache.get("third"), self.claims)
+
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = UserCache()
+        patcher = patch.object(UserCache, "r", AsyncMock())
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User(id=1, username="tester", email="test@test.com", password="hash", refresh_token="token",
+                         confirmed=True, avatar=None, created_at=datetime(2024, 1, 1, 12, 30), contacts_count=3)
+
+    async def test_stores_only_public_fields(self):
+        await self.cache.set(self.user, 60)
+        name, value = self.redis.set.await_args.args
+        self.assertEqual(name, "user:test@test.com")
+        self.assertEqual(set(json.loads(value)), {"id", "username", "email", "confirmed", "avatar", "created_at"})
+
+    async def test_round_trip(self):
+        await self.cache.set(self.user, 60)
+        self.redis.get.return_value = self.redis.set.await_args.args[1].encode()
+        user = await self.cache.get("test@test.com")
+        self.assertEqual((user.id, user.email, user.confirmed, user.created_at), (1, "test@test.com", True, self.user.created_at))
+        self.assertIsNone(user.password)
+
+    async def test_old_entry_is_a_miss(self):
+        self.redis.get.return_value = pickle.dumps({"id": 1})
+        self.assertIsNone(await self.cache.get("test@test.com"))
+
+
+
+class TestBirthdayCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = BirthdayCache()
+        patcher = patch.object(BirthdayCache, "r", MagicMock())
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis.hget = AsyncMock()
+        self.pipe = MagicMock(execute=AsyncMock())
+        self.redis.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.pipe.hset.return_value.expireat.return_value = self.pipe
+        row = namedtuple("Row", ("id", "name", "birthday", "created_at"))
+        self.rows = [row(1, "Jon", date(1990, 1, 2), datetime(2024, 1, 1, 12, 30)), row(2, "Ann", None, None)]
+
+    async def test_round_trip(self):
+        await self.cache.set(1, "v1:page", self.rows, datetime(2024, 1, 2))
+        name, key, value = self.pipe.hset.call_args.args
+        self.assertEqual((name, key), ("birthdays:1", "v1:page"))
+        self.redis.hget.return_value = value.encode()
+        rows = await self.cache.get(1, "v1:page")
+        self.assertEqual([tuple(row) for row in rows], [tuple(row) for row in self.rows])
+        self.assertEqual(rows[0]._mapping["birthday"], date(1990, 1, 2))
+        self.assertEqual(rows[1]._asdict()["name"], "Ann")
+
+    async def test_old_entry_is_a_miss(self):
+        self.redis.hget.return_value = pickle.dumps([tuple(row) for row in self.rows])
+        self.assertIsNone(await self.cache.get(1, "v1:page"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from email.message import EmailMessage
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiosmtplib
+
+from src.services.email import EmailSender
+
+
+class TestEmailSender(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sender = EmailSender(hostname="localhost", port=25, pool_size=1)
+        self.smtp = MagicMock(is_connected=True)
+        self.smtp.send_message = AsyncMock()
+        self.smtp.quit = AsyncMock()
+        patcher = patch.object(self.sender, "connect", AsyncMock(return_value=self.smtp))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.sender.close()
+
+    async def test_cancelled_send_keeps_worker(self):
+        sent = asyncio.Event()
+
+        async def slow_send(message):
+            await sent.wait()
+
+        self.smtp.send_message.side_effect = slow_send
+        first = asyncio.create_task(self.sender.send(EmailMessage()))
+        await asyncio.sleep(0)
+        first.cancel()
+        sent.set()
+        self.smtp.send_message.side_effect = None
+        await asyncio.wait_for(self.sender.send(EmailMessage()), 1)
+        self.assertTrue(all(not worker.done() for worker in self.sender.workers))
+
+    async def test_unexpected_error_fails_only_its_message(self):
+        self.smtp.send_message.side_effect = [ValueError("bad header"), None]
+        # not assertRaises: it clears the traceback frames, the live frame of the worker among them
+        first = asyncio.create_task(self.sender.send(EmailMessage()))
+        await asyncio.wait([first], timeout=1)
+        self.assertIsInstance(first.exception(), ValueError)
+        await asyncio.wait_for(self.sender.send(EmailMessage()), 1)
+        self.smtp.close.assert_called_once()
+
+
+    async def test_close_fails_messages_not_sent(self):
+        started = asyncio.Event()
+
+        async def hanging_send(message):
+            started.set()
+            await asyncio.Event().wait()
+
+        self.smtp.send_message.side_effect = hanging_send
+        sending = asyncio.create_task(self.sender.send(EmailMessage()))
+        queued = asyncio.create_task(self.sender.send(EmailMessage()))
+        await started.wait()
+        await self.sender.close()
+        await asyncio.wait([sending, queued], timeout=1)
+        self.assertIsInstance(sending.exception(), aiosmtplib.SMTPException)
+        self.assertIsInstance(queued.exception(), aiosmtplib.SMTPException)
+
+
+class TestEmailSenderPool(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_uses_every_connection(self):
+        sender = EmailSender(hostname="localhost", port=25, pool_size=2)
+        release = asyncio.Event()
+        connections = []
+
+        async def send_message(message):
+            await release.wait()
+
+        async def connect():
+            smtp = MagicMock(is_connected=True, quit=AsyncMock())
+            smtp.send_message = AsyncMock(side_effect=send_message)
+            connections.append(smtp)
+            return smtp
+
+        with patch.object(sender, "connect", connect):
+            sends = [asyncio.create_task(sender.send(EmailMessage())) for _ in range(4)]
+            await asyncio.sleep(0.01)
+            # both connections are busy with a message while the rest waits in the queue
+            self.assertEqual([smtp.send_message.await_count for smtp in connections], [1, 1])
+            release.set()
+            await asyncio.wait_for(asyncio.gather(*sends), 1)
+            await sender.close()
+        self.assertEqual(sum(smtp.send_message.await_count for smtp in connections), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from src.services.cache import TokenCache
+from src.services.metrics import MetricsMiddleware, TokenCacheCollector, statement_type
+
+
+class TestMetrics(unittest.TestCase):
+    def test_statement_type(self):
+        self.assertEqual(statement_type("  select * from contacts"), "SELECT")
+        self.assertEqual(statement_type("INSERT INTO contacts ..."), "INSERT")
+        self.assertEqual(statement_type("BEGIN"), "OTHER")
+
+    def test_token_cache_collector(self):
+        cache = TokenCache(maxsize=10)
+        cache.set("token", {"exp": time.time() + 60})
+        cache.get("token")
+        cache.get("other")
+        metrics = {metric.name: metric.samples[0].value for metric in TokenCacheCollector(cache).collect()}
+        self.assertEqual(metrics, {"token_cache_entries": 1, "token_cache_hits": 1, "token_cache_misses": 1})
+
+
+class TestMetricsMiddleware(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/metrics-test/{item_id}")
+        async def read_item(item_id: int):
+            return {"id": item_id}
+
+        self.client = TestClient(app)
+
+    @staticmethod
+    def requests(route: str, status: str) -> float:
+        return REGISTRY.get_sample_value("http_requests_total", {"method": "GET", "route": route, "status": status}) or 0
+
+    def test_route_label_is_the_path_template(self):
+        before = self.requests("/metrics-test/{item_id}", "200")
+        for item_id in (1, 2):
+            self.client.get(f"/metrics-test/{item_id}")
+        self.assertEqual(self.requests("/metrics-test/{item_id}", "200") - before, 2)
+
+    def test_plain_and_unmatched_routes(self):
+        docs, unmatched = self.requests("/docs", "200"), self.requests("unmatched", "404")
+        self.client.get("/docs")
+        self.client.get("/metrics-test-missing")
+        self.assertEqual(self.requests("/docs", "200") - docs, 1)
+        self.assertEqual(self.requests("unmatched", "404") - unmatched, 1)
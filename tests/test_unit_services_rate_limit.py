@@ -0,0 +1,31 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.rate_limit import SlidingWindowLimiter, limit_cost
+
+
+class TestRateLimit(unittest.IsolatedAsyncioTestCase):
+    def test_limit_cost(self):
+        request = MagicMock()
+        request.query_params = {"limit": "1000"}
+        self.assertEqual(limit_cost(request), 10)
+        request.query_params = {}
+        self.assertEqual(limit_cost(request), 1)
+        request.query_params = {"limit": "many"}
+        self.assertEqual(limit_cost(request), 1)
+
+    async def test_lease_served_in_process(self):
+        limiter = SlidingWindowLimiter(lease_fraction=0.1)
+        limiter.script = AsyncMock(return_value=[1, 89, 10])
+        self.assertEqual(await limiter.hit("key", 100, 60), (True, 99, 0.0))
+        for _ in range(10):
+            allowed, _, _ = await limiter.hit("key", 100, 60)
+            self.assertTrue(allowed)
+        limiter.script.assert_awaited_once()
+        await limiter.hit("key", 100, 60)
+        self.assertEqual(limiter.script.await_count, 2)
+
+    async def test_rejected(self):
+        limiter = SlidingWindowLimiter()
+        limiter.script = AsyncMock(return_value=[0, 0, 1500])
+        self.assertEqual(await limiter.hit("key", 100, 60, cost=5), (False, 0, 1.5))
@@ -0,0 +1,44 @@
+import unittest
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from src.services.upload_limit import BodySizeLimitMiddleware
+
+
+class TestBodySizeLimitMiddleware(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(BodySizeLimitMiddleware, limits={"/upload": 1024})
+
+        @app.post("/upload")
+        async def upload(file: UploadFile = File()):
+            return {"size": len(await file.read())}
+
+        @app.post("/other")
+        async def other(file: UploadFile = File()):
+            return {"size": len(await file.read())}
+
+        self.client = TestClient(app)
+
+    def test_small_upload(self):
+        response = self.client.post("/upload", files={"file": ("a.bin", b"x" * 100)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["size"], 100)
+
+    def test_content_length_over_limit(self):
+        response = self.client.post("/upload", files={"file": ("a.bin", b"x" * 4096)})
+        self.assertEqual(response.status_code, 413)
+
+    def test_chunked_body_over_limit(self):
+        body = (b"x" * 512 for _ in range(8))
+        response = self.client.post("/upload", content=body, headers={"content-type": "multipart/form-data; boundary=b"})
+        self.assertEqual(response.status_code, 413)
+
+    def test_other_paths_unlimited(self):
+        response = self.client.post("/other", files={"file": ("a.bin", b"x" * 4096)})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()